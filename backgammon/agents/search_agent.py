@@ -0,0 +1,188 @@
+import time
+import numpy as np
+
+from ..features import BOARD_SIZE, NUM_POINTS, game_outcomes, equity_value
+from ..transposition import zobrist_hash, evaluate_boards
+
+# positions featurized and scored per forward pass, bounds memory on deep searches
+BATCH_SIZE = 8192
+
+# the 21 distinct rolls and their probabilities
+ROLLS = [((a, b), (1. if a == b else 2.) / 36.) for a in range(1, 7) for b in range(a, 7)]
+
+class SearchAgent(object):
+    """
+    Expectimax search over the dice to the given depth in plies
+    (1-ply is the greedy TDAgent choice).
+
+    Each level keeps only the top_k moves of every decision by their
+    1-ply value before searching them deeper, and all positions of a
+    level are scored with a single forward pass. Node counts and timing
+    for the last move are kept in self.stats.
+
+    With a TranspositionTable, network values and the results of
+    searched subtrees are shared between move orders and turns. With a
+    RaceEvaluator, positions it covers are scored by it instead of the
+    network, and once the position itself is covered moves are picked
+    without searching. Finished games are scored exactly and never
+    searched past.
+    """
+
+    # Game.take_turn hands us the distinct afterstates instead of all move tuples
+    uses_afterstates = True
+
+    def __init__(self, player, model, depth=2, top_k=4, move_cache=None, table=None, race=None):
+        self.player = player
+        self.model = model
+        self.depth = depth
+        self.top_k = top_k
+        self.move_cache = move_cache
+        self.table = table
+        self.race = race
+        self.name = 'TD-Gammon (%d-ply)' % depth
+        self.stats = {'nodes': 0, 'evaluations': 0, 'time': 0.}
+
+    def get_action(self, actions, game):
+        """
+        Return best action according to an expectimax search
+        of self.depth plies.
+        """
+        actions = list(actions)
+        if not actions:
+            return None
+
+        boards = np.empty((len(actions), BOARD_SIZE), dtype=np.int8)
+        for i, a in enumerate(actions):
+            ateList = game.take_action(a, self.player)
+            boards[i] = game.encode()
+            game.undo_action(a, self.player, ateList)
+
+        return self.get_afterstate_action(actions, boards, game)
+
+    def get_afterstate_action(self, actions, boards, game):
+        """
+        Return the action whose afterstate in boards is best according
+        to an expectimax search of self.depth plies.
+        """
+        start_time = time.time()
+        self.stats = {'nodes': len(actions), 'evaluations': 0, 'time': 0.}
+
+        values = self.evaluate(game, boards, game.opponent(self.player))
+
+        searching = self.race is None or not self.race.covers(game.encode())[0]
+        if self.depth > 1 and len(actions) > 1 and searching:
+            keep = np.argsort(-values)[:self.top_k]
+            paths = [[(actions[i], self.player)] for i in keep]
+            values = np.full(len(actions), -np.inf)
+            values[keep] = self.search(game, paths, game.opponent(self.player), self.depth - 1)
+
+        self.stats['time'] = time.time() - start_time
+        return actions[int(np.argmax(values))]
+
+    def search(self, game, paths, mover, depth):
+        """
+        Expected value for self.player of the positions reached by
+        playing each path of (move, player) pairs from game, with mover
+        about to roll and depth plies left to search.
+        """
+        results = np.empty(len(paths))
+        expanded, moves, boards, owners = [], [], [], []
+        turn = game.players.index(mover)
+        for p, path in enumerate(paths):
+            ateLists = self.apply(game, path)
+            if game.is_over():
+                results[p] = self.perspective(game, equity_value(game.outcome(self.model.outputs).reshape(1, -1))[0])
+                self.unapply(game, path, ateLists)
+                continue
+            key = None
+            if self.table is not None:
+                key = int(zobrist_hash(game.encode(), turn)[0])
+                value = self.table.probe(key, depth)
+                if value is not None:
+                    results[p] = self.perspective(game, value)
+                    self.unapply(game, path, ateLists)
+                    continue
+            expanded.append((p, key))
+            for roll, _ in ROLLS:
+                actions, afterstates = self.get_afterstates(game, roll, mover)
+                # with no legal moves the position is passed on unchanged
+                if not actions:
+                    actions = [None]
+                    afterstates = np.array(game.encode(), dtype=np.int8).reshape(1, BOARD_SIZE)
+                moves.append(actions)
+                boards.append(afterstates)
+                owners.append(p)
+                self.stats['nodes'] += len(actions)
+            self.unapply(game, path, ateLists)
+
+        if not expanded:
+            return results
+
+        next_mover = game.opponent(mover)
+        values = self.evaluate(game, np.vstack(boards), next_mover)
+
+        # slice of values for each (path, roll) decision
+        bounds = np.cumsum([0] + [len(m) for m in moves])
+        maximize = mover == self.player
+
+        if depth > 1:
+            # search the top_k moves of every decision one ply deeper
+            child_paths, kept = [], []
+            for k, decision_moves in enumerate(moves):
+                decision_values = values[bounds[k]:bounds[k + 1]]
+                order = np.argsort(-decision_values if maximize else decision_values)[:self.top_k]
+                kept.append(len(order))
+                for i in order:
+                    child_paths.append(paths[owners[k]] + [(decision_moves[i], mover)])
+            deeper = self.search(game, child_paths, next_mover, depth - 1)
+            decisions = np.split(deeper, np.cumsum(kept)[:-1])
+        else:
+            decisions = [values[bounds[k]:bounds[k + 1]] for k in range(len(moves))]
+
+        best = np.array([np.max(d) if maximize else np.min(d) for d in decisions])
+        weights = np.array([w for _, w in ROLLS])
+        values = np.dot(best.reshape(len(expanded), len(ROLLS)), weights)
+        for (p, key), value in zip(expanded, values):
+            results[p] = value
+            if key is not None:
+                self.table.store(key, self.perspective(game, value), depth)
+        return results
+
+    def get_afterstates(self, game, roll, player):
+        if self.move_cache is not None:
+            return self.move_cache.get_afterstates(game, roll, player)
+        return game.get_afterstates(roll, player)
+
+    def apply(self, game, path):
+        return [game.take_action(move, player) if move else None for move, player in path]
+
+    def unapply(self, game, path, ateLists):
+        for (move, player), ateList in reversed(zip(path, ateLists)):
+            if move:
+                game.undo_action(move, player, ateList)
+
+    def evaluate(self, game, boards, mover):
+        """
+        Value for self.player of each board with mover about to roll.
+        """
+        boards = np.asarray(boards, dtype=np.int8).reshape(-1, BOARD_SIZE)
+        # a player with every checker off has won, its outcome needs no network
+        won = boards[:, NUM_POINTS + 2:] >= np.array(game.piece_counts())
+        over = np.any(won, axis=1)
+        values = np.empty(len(boards))
+        if np.any(over):
+            outcomes = game_outcomes(boards[over], won[over, 1].astype(np.int64), self.model.outputs)
+            values[over] = self.perspective(game, equity_value(outcomes))
+        if not np.all(over):
+            v = evaluate_boards(self.model, boards[~over], game.players.index(mover), game.piece_counts(), \
+                self.table, batch_size=BATCH_SIZE, race=self.race)
+            values[~over] = self.perspective(game, v)
+            self.stats['evaluations'] += int(np.sum(~over))
+        return values
+
+    def perspective(self, game, v):
+        """
+        Convert between values of evaluate_boards, P(players[1] wins)
+        for a single output network, and values for self.player.
+        """
+        return 1. - v if self.player == game.players[0] else v
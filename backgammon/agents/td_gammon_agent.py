@@ -1,10 +1,22 @@
 import numpy as np
 
+from ..features import BOARD_SIZE
+from ..transposition import evaluate_boards
+
 class TDAgent(object):
 
-    def __init__(self, player, model):
+    # Game.take_turn hands us the distinct afterstates instead of all move tuples
+    uses_afterstates = True
+
+    def __init__(self, player, model, table=None, race=None):
         self.player = player
         self.model = model
+        # optional TranspositionTable of network values reused across turns
+        self.table = table
+        # optional RaceEvaluator used instead of the network once contact is broken
+        self.race = race
+        # network output for the afterstate of the last move picked, the TD target of the position before it
+        self.value = None
         self.name = 'TD-Gammon'
 
     def get_action(self, actions, game):
@@ -12,17 +24,26 @@ class TDAgent(object):
         Return best action according to self.evaluationFunction,
         with no lookahead.
         """
-        v_best = 0
-        a_best = None
+        actions = list(actions)
+        if not actions:
+            return None
 
-        for a in actions:
+        boards = np.empty((len(actions), BOARD_SIZE), dtype=np.int8)
+        for i, a in enumerate(actions):
             ateList = game.take_action(a, self.player)
-            features = game.extract_features(game.opponent(self.player))
-            v = self.model.get_output(features)
-            v = 1. - v if self.player == game.players[0] else v
-            if v > v_best:
-                v_best = v
-                a_best = a
+            boards[i] = game.encode()
             game.undo_action(a, self.player, ateList)
 
-        return a_best
+        return self.get_afterstate_action(actions, boards, game)
+
+    def get_afterstate_action(self, actions, boards, game):
+        """
+        Return the action whose afterstate in boards scores best,
+        all afterstates are featurized and scored in one pass.
+        """
+        turn = game.players.index(game.opponent(self.player))
+        v = evaluate_boards(self.model, boards, turn, game.piece_counts(), self.table, race=self.race)
+        best = int(np.argmax(1. - v if self.player == game.players[0] else v))
+
+        self.value = v[best]
+        return actions[best]
@@ -0,0 +1,185 @@
+from __future__ import division
+
+import os
+import numpy as np
+
+from .features import BOARD_SIZE, NUM_POINTS
+
+# one-sided positions: up to MAX_CHECKERS checkers on the 6 home points
+HOME_POINTS = 6
+MAX_CHECKERS = 15
+
+# distribution of the number of rolls to bear off, the last bin holds the tail
+MAX_ROLLS = 32
+
+_BINOMIAL = np.zeros((MAX_CHECKERS + HOME_POINTS + 1, HOME_POINTS + 1), dtype=np.int64)
+for _n in range(MAX_CHECKERS + HOME_POINTS + 1):
+    _BINOMIAL[_n, 0] = 1
+    for _k in range(1, min(_n, HOME_POINTS) + 1):
+        _BINOMIAL[_n, _k] = _BINOMIAL[_n - 1, _k - 1] + (_BINOMIAL[_n - 1, _k] if _k <= _n - 1 else 0)
+
+NUM_POSITIONS = int(_BINOMIAL[MAX_CHECKERS + HOME_POINTS, HOME_POINTS])
+
+def position_index(counts):
+    """
+    Perfect hash of home board distributions into [0, NUM_POSITIONS).
+
+    counts is an [..., 6] array of checkers by distance from off (1 to 6).
+    The checkers and the 6 point separators are laid out as stars and
+    bars, with the borne off checkers last; the index is the combinatorial
+    number of the separator positions.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    separators = np.cumsum(counts, axis=-1) + np.arange(HOME_POINTS)
+    return np.sum(_BINOMIAL[separators, np.arange(1, HOME_POINTS + 1)], axis=-1)
+
+def no_contact(boards):
+    """
+    True for each board of an [N, 28] stack that can be scored as a race:
+    both sides only have checkers left in the home board, none on the
+    bar, and no blot of either side has an opposing checker behind it,
+    since both sides move the same way through the shared home board and
+    such a blot could still be hit.
+    """
+    boards = np.asarray(boards).reshape(-1, BOARD_SIZE)
+    points = boards[:, :NUM_POINTS]
+    outside = np.any(points[:, :NUM_POINTS - HOME_POINTS] != 0, axis=1)
+    on_bar = np.any(boards[:, NUM_POINTS:NUM_POINTS + 2] != 0, axis=1)
+    # whether each side has a checker on a lower point than each point
+    behind = [np.cumsum(points > 0, axis=1) - (points > 0) > 0, np.cumsum(points < 0, axis=1) - (points < 0) > 0]
+    hits = np.any(((points == 1) & behind[1]) | ((points == -1) & behind[0]), axis=1)
+    return ~(outside | on_bar | hits)
+
+def _all_positions():
+    positions = []
+    def fill(prefix, left):
+        if len(prefix) == HOME_POINTS:
+            positions.append(tuple(prefix))
+            return
+        for n in range(left + 1):
+            fill(prefix + [n], left - n)
+    fill([], MAX_CHECKERS)
+    return positions
+
+def _die_moves(position, r):
+    """
+    Positions reachable by playing a single die r, with the rules
+    of Game.remove_piece.
+    """
+    results = []
+    for d in range(1, HOME_POINTS + 1):
+        if not position[d - 1]:
+            continue
+        # bearing off with a higher die is only allowed from the farthest point
+        if d < r and any(position[d:]):
+            continue
+        result = list(position)
+        result[d - 1] -= 1
+        if d > r:
+            result[d - r - 1] += 1
+        results.append(tuple(result))
+    return results
+
+def _roll_moves(position, roll):
+    """
+    Positions reachable with roll, using as many dice as possible
+    the way Game.get_actions does.
+    """
+    r1, r2 = roll
+    if r1 == r2:
+        for n in range(4, 0, -1):
+            frontier = set([position])
+            for _ in range(n):
+                frontier = set(p for f in frontier for p in _die_moves(f, r1))
+            if frontier:
+                return frontier
+        return set()
+    results = set()
+    for a, b in ((r1, r2), (r2, r1)):
+        for p in _die_moves(position, a):
+            results.update(_die_moves(p, b))
+    if not results:
+        for r in roll:
+            results.update(_die_moves(position, r))
+    return results
+
+def build():
+    """
+    Compute the database: for every position the expected number of rolls
+    to bear off (column 0) and the probability of needing exactly k rolls
+    (columns 1 to MAX_ROLLS), always playing to minimize expected rolls.
+    """
+    rolls = [((a, b), (1. if a == b else 2.) / 36.) for a in range(1, 7) for b in range(a, 7)]
+    table = np.zeros((NUM_POSITIONS, MAX_ROLLS + 1), dtype=np.float32)
+
+    # every move lowers the pip count, so successors are always solved first
+    positions = sorted(_all_positions(), key=lambda p: sum((d + 1) * n for d, n in enumerate(p)))
+    table[position_index(positions[0]), 1] = 1.
+    for position in positions[1:]:
+        expected = 1.
+        distribution = np.zeros(MAX_ROLLS)
+        for roll, weight in rolls:
+            successors = position_index(list(_roll_moves(position, roll)))
+            best = successors[np.argmin(table[successors, 0])]
+            expected += weight * table[best, 0]
+            # one more roll shifts the successor's distribution, keeping the tail in the last bin
+            shifted = np.zeros(MAX_ROLLS)
+            shifted[1:] = table[best, 1:MAX_ROLLS]
+            shifted[-1] += table[best, MAX_ROLLS]
+            distribution += weight * shifted
+        index = position_index(position)
+        table[index, 0] = expected
+        table[index, 1:] = distribution
+    return table
+
+class BearoffDatabase(object):
+    """
+    One-sided bear-off database for all distributions of up to 15 checkers
+    on the 6 home points, stored as a memory-mapped .npy file.
+
+    Two-sided values combine both players' distributions of rolls to bear
+    off. Both sides share the home board in this game, so only positions
+    where no blot can be hit are covered, see no_contact.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    @staticmethod
+    def load(path, build_missing=True):
+        if not os.path.exists(path):
+            if not build_missing:
+                raise IOError('No bear-off database at {0}'.format(path))
+            np.save(path, build())
+        return BearoffDatabase(np.load(path, mmap_mode='r'))
+
+    def home_counts(self, boards, player):
+        """
+        Checkers of the player at index player on each home point, ordered by
+        distance from off, for an [N, 28] stack of boards.
+        """
+        points = np.asarray(boards, dtype=np.int64)[:, NUM_POINTS - HOME_POINTS:NUM_POINTS][:, ::-1]
+        return np.maximum(points if player == 0 else -points, 0)
+
+    def covers(self, boards):
+        """
+        True for each board without contact, see no_contact.
+        """
+        return no_contact(boards)
+
+    def expected_rolls(self, boards, player):
+        boards = np.asarray(boards).reshape(-1, BOARD_SIZE)
+        return self.table[position_index(self.home_counts(boards, player)), 0]
+
+    def get_output(self, boards, turn):
+        """
+        P(players[1] wins) for each of an [N, 28] stack of bear-off boards
+        with the player at index turn about to roll, like the network output.
+        """
+        boards = np.asarray(boards).reshape(-1, BOARD_SIZE)
+        mover = self.table[position_index(self.home_counts(boards, turn)), 1:]
+        other = self.table[position_index(self.home_counts(boards, 1 - turn)), 1:]
+        # the player to move wins if they need no more rolls than the other side
+        other_survival = 1. - np.cumsum(other, axis=1) + other
+        p = np.sum(mover * other_survival, axis=1)
+        return p if turn == 1 else 1. - p
@@ -0,0 +1,71 @@
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    Bounded mapping that evicts the least recently used entry
+    once capacity is reached. Tracks hits and misses.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.capacity:
+            self.entries.popitem(last=False)
+        self.entries[key] = value
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / float(total) if total else 0.
+
+class MoveCache(LRUCache):
+    """
+    Memoizes Game.get_actions and Game.get_afterstates
+    by (position, player, roll).
+    """
+
+    def __init__(self, capacity=20000):
+        super(MoveCache, self).__init__(capacity)
+
+    def get_actions(self, game, roll, player, nodups=False):
+        # the move set doesn't depend on the order the dice are listed in, generating
+        # it from the sorted roll also keeps its iteration order reproducible
+        roll = (min(roll), max(roll))
+        key = (game.position_key(), player) + roll
+        moves = self.get(key)
+        if moves is None:
+            moves = frozenset(game.get_actions(roll, player, nodups=nodups))
+            self.put(key, moves)
+        return moves
+
+    def get_afterstates(self, game, roll, player):
+        roll = (min(roll), max(roll))
+        key = (game.position_key(), player) + roll + ('afterstates', )
+        afterstates = self.get(key)
+        if afterstates is None:
+            afterstates = game.get_afterstates(roll, player)
+            self.put(key, afterstates)
+        return afterstates
@@ -0,0 +1,319 @@
+import array
+import numpy as np
+
+from .game import Game
+
+class CompactGame(Game):
+    """
+    Drop-in alternative to Game that stores the board as a fixed-size
+    buffer of signed checker counts instead of nested lists of tokens.
+
+    Layout of the buffer (28 signed bytes):
+        [0, 24)  checkers per point, positive for players[0], negative for players[1]
+        24, 25   checkers on the bar for players[0], players[1]
+        26, 27   checkers borne off for players[0], players[1]
+    """
+
+    BAR_INDEX = 24
+    OFF_INDEX = 26
+    SIZE = 28
+
+    def __init__(self, layout=Game.LAYOUT, board=None, num_pieces=None, players=None):
+        """
+        Define a new game object
+        """
+        self.die = Game.QUAD
+        self.layout = layout
+        if board is not None:
+            self.board = array.array('b', board)
+            self.num_pieces = dict(num_pieces)
+            self.players = list(players)
+            self.count_pips()
+            return
+        self.players = list(Game.TOKENS)
+        self.board = array.array('b', [0] * CompactGame.SIZE)
+        self.num_pieces = {}
+        for t in self.players:
+            self.num_pieces[t] = 0
+        self.count_pips()
+
+    @staticmethod
+    def new(move_cache=None):
+        game = CompactGame()
+        game.reset()
+        game.move_cache = move_cache
+        return game
+
+    @staticmethod
+    def from_game(game):
+        """
+        Build a compact copy of a list-based Game.
+        """
+        compact = CompactGame(players=game.players, num_pieces=game.num_pieces, board=[0] * CompactGame.SIZE)
+        for i, col in enumerate(game.grid):
+            if col:
+                compact.board[i] = compact.sign(col[0]) * len(col)
+        for n, t in enumerate(game.players):
+            compact.board[CompactGame.BAR_INDEX + n] = len(game.bar_pieces[t])
+            compact.board[CompactGame.OFF_INDEX + n] = len(game.off_pieces[t])
+        compact.count_pips()
+        return compact
+
+    def to_game(self):
+        """
+        Build a list-based Game holding the same position.
+        """
+        game = Game()
+        game.players = self.players
+        for i in range(Game.NUMCOLS):
+            n = self.board[i]
+            if n:
+                game.grid[i] = [self.players[0] if n > 0 else self.players[1]] * abs(n)
+        for n, t in enumerate(self.players):
+            game.bar_pieces[t] = [t] * self.board[CompactGame.BAR_INDEX + n]
+            game.off_pieces[t] = [t] * self.board[CompactGame.OFF_INDEX + n]
+            game.num_pieces[t] = self.num_pieces[t]
+        return game
+
+    def sign(self, token):
+        return 1 if token == self.players[0] else -1
+
+    def count(self, i, token):
+        """
+        Number of checkers token has on point i.
+        """
+        n = self.board[i] * self.sign(token)
+        return n if n > 0 else 0
+
+    def bar_count(self, token):
+        return self.board[CompactGame.BAR_INDEX + self.players.index(token)]
+
+    def off_count(self, token):
+        return self.board[CompactGame.OFF_INDEX + self.players.index(token)]
+
+    def encode(self):
+        # a view of the live buffer, copy it to keep a snapshot of the position
+        return np.frombuffer(self.board, dtype=np.int8)
+
+    def position_key(self):
+        return self.board.tostring()
+
+    def count_pips(self):
+        """
+        Recompute each player's pip count and number of checkers outside
+        the home board, which take_action and undo_action then keep up to date.
+        """
+        home = Game.NUMCOLS - self.die
+        self.pips = {}
+        self.outside = {}
+        for n, t in enumerate(self.players):
+            bar = self.board[CompactGame.BAR_INDEX + n]
+            self.pips[t] = (Game.NUMCOLS + 1) * bar
+            self.outside[t] = bar
+            for i in range(Game.NUMCOLS):
+                count = self.count(i, t)
+                self.pips[t] += (Game.NUMCOLS - i) * count
+                if i < home:
+                    self.outside[t] += count
+        self.update_contact()
+
+    def clone(self):
+        """
+        Return an exact copy of the game. Changes can be made
+        to the cloned version without affecting the original.
+        """
+        return CompactGame(None, self.board, self.num_pieces, self.players)
+
+    def take_action(self, action, token):
+        """
+        Makes given move for player, assumes move is valid,
+        will remove pieces from play
+        """
+        board = self.board
+        s = self.sign(token)
+        n = self.players.index(token)
+        ateList = [0] * 4
+        for i, (start, end) in enumerate(action):
+            if start == Game.ON:
+                board[CompactGame.BAR_INDEX + n] -= 1
+            else:
+                board[start] -= s
+            if end == Game.OFF:
+                board[CompactGame.OFF_INDEX + n] += 1
+            else:
+                if board[end] * s < 0:
+                    board[end] = 0
+                    board[CompactGame.BAR_INDEX + 1 - n] += 1
+                    ateList[i] = 1
+                board[end] += s
+            self.update_pips(token, start, end, ateList[i], 1)
+        self.update_contact()
+        return ateList
+
+    def undo_action(self, action, player, ateList):
+        """
+        Reverses given move for player, assumes move is valid,
+        will remove pieces from play
+        """
+        board = self.board
+        s = self.sign(player)
+        n = self.players.index(player)
+        for i, (start, end) in enumerate(reversed(action)):
+            if end == Game.OFF:
+                board[CompactGame.OFF_INDEX + n] -= 1
+            else:
+                board[end] -= s
+                if ateList[len(action) - 1 - i]:
+                    board[CompactGame.BAR_INDEX + 1 - n] -= 1
+                    board[end] = -s
+            if start == Game.ON:
+                board[CompactGame.BAR_INDEX + n] += 1
+            else:
+                board[start] += s
+            self.update_pips(player, start, end, ateList[len(action) - 1 - i], -1)
+        self.update_contact()
+
+    def find_moves(self, rs, player, move, moves, start=None):
+        if len(rs) == 0:
+            moves.add(move)
+            return
+        board = self.board
+        s = self.sign(player)
+        bar = CompactGame.BAR_INDEX + self.players.index(player)
+        opponent_bar = CompactGame.BAR_INDEX + 1 - self.players.index(player)
+        r, rs = rs[0], rs[1:]
+        # see if we can remove a piece from the bar
+        if board[bar]:
+            if self.can_onboard(player, r):
+                e = r - 1
+                hit = board[e] * s == -1
+                board[bar] -= 1
+                if hit:
+                    board[e] = 0
+                    board[opponent_bar] += 1
+                board[e] += s
+
+                self.find_moves(rs, player, move + ((Game.ON, e), ), moves, start)
+                board[e] -= s
+                board[bar] += 1
+                if hit:
+                    board[e] = -s
+                    board[opponent_bar] -= 1
+            return
+
+        # otherwise check each grid location for valid move using r
+        offboarding = self.can_offboard(player)
+        off = CompactGame.OFF_INDEX + self.players.index(player)
+
+        for i in range(Game.NUMCOLS):
+            if self.is_valid_move(i, i + r, player):
+                e = i + r
+                hit = board[e] * s == -1
+                board[i] -= s
+                if hit:
+                    board[e] = 0
+                    board[opponent_bar] += 1
+                board[e] += s
+                self.find_moves(rs, player, move + ((i, e), ), moves, start)
+                board[e] -= s
+                board[i] += s
+                if hit:
+                    board[e] = -s
+                    board[opponent_bar] -= 1
+
+            # If we can't move on the board can we take the piece off?
+            if offboarding and self.remove_piece(player, i, r):
+                board[i] -= s
+                board[off] += 1
+                self.find_moves(rs, player, move + ((i, Game.OFF), ), moves, start)
+                board[off] -= 1
+                board[i] += s
+
+    def reverse(self):
+        """
+        Reverses a game allowing it to be seen by the opponent
+        from the same perspective
+        """
+        board = self.board
+        points = [-n for n in reversed(board[:Game.NUMCOLS])]
+        board[:Game.NUMCOLS] = array.array('b', points)
+        board[24], board[25] = board[25], board[24]
+        board[26], board[27] = board[27], board[26]
+        self.players.reverse()
+        self.count_pips()
+
+    def reset(self):
+        """
+        Resets game to original layout.
+        """
+        for col in self.layout.split(','):
+            loc, num, token = col.split('-')
+            self.board[int(loc)] = self.sign(token) * int(num)
+            self.num_pieces[token] += int(num)
+        self.count_pips()
+
+    def winner(self):
+        """
+        Get winner.
+        """
+        return 0 if self.board[CompactGame.OFF_INDEX] == self.num_pieces[self.players[0]] else 1
+
+    def is_gammon(self):
+        """
+        Checks if the game was won before the loser bore off any pieces.
+        """
+        return self.is_over() and self.board[CompactGame.OFF_INDEX + 1 - self.winner()] == 0
+
+    def is_over(self):
+        """
+        Checks if the game is over.
+        """
+        for n, t in enumerate(self.players):
+            if self.board[CompactGame.OFF_INDEX + n] == self.num_pieces[t]:
+                return True
+        return False
+
+    def can_offboard(self, player):
+        count = 0
+        for i in range(Game.NUMCOLS - self.die, Game.NUMCOLS):
+            count += self.count(i, player)
+        if count + self.off_count(player) == self.num_pieces[player]:
+            return True
+        return False
+
+    def can_onboard(self, player, r):
+        """
+        Can we take a players piece on the bar to a position
+        on the grid given by roll-1?
+        """
+        return self.board[r - 1] * self.sign(player) >= -1
+
+    def remove_piece(self, player, start, r):
+        """
+        Can we remove a piece from location start with roll r ?
+        In this function we assume we are cool to offboard,
+        i.e. no pieces on the bar and all are in the home quadrant.
+        """
+        if start < Game.NUMCOLS - self.die:
+            return False
+        if self.board[start] * self.sign(player) <= 0:
+            return False
+        if start + r == Game.NUMCOLS:
+            return True
+        if start + r > Game.NUMCOLS:
+            for i in range(start - 1, Game.NUMCOLS - self.die - 1, -1):
+                if self.board[i] * self.sign(player) > 0:
+                    return False
+            return True
+        return False
+
+    def is_valid_move(self, start, end, token):
+        s = self.sign(token)
+        if self.board[start] * s > 0:
+            if end < 0 or end >= Game.NUMCOLS:
+                return False
+            return self.board[end] * s >= -1
+        return False
+
+    def draw(self):
+        self.to_game().draw()
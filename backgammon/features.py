@@ -0,0 +1,240 @@
+import numpy as np
+
+NUM_FEATURES = 294
+
+# boards are rows of 28 signed counts in the CompactGame layout:
+# 24 points (positive for players[0]), bar for each player, off for each player
+BOARD_SIZE = 28
+NUM_POINTS = 24
+
+# truncated unary encoding of a point: one unit for each of the first
+# five checkers and the remainder in the sixth unit
+UNITS = 6
+POINT_FEATURES = NUM_POINTS * UNITS
+PLAYER_FEATURES = POINT_FEATURES + 2
+_OFFSETS = np.arange(UNITS, dtype=np.int32)
+
+# one-hot encoding of 1 to MAX_CHECKERS checkers, an empty slot has no unit set
+MAX_CHECKERS = 15
+_COUNTS = np.arange(1, MAX_CHECKERS + 1, dtype=np.int32)
+
+# a slot is a point, the bar or the off tray of one player, holding 0 to
+# MAX_CHECKERS of that player's checkers
+SLOTS = BOARD_SIZE - 2
+NUM_SLOTS = 2 * SLOTS
+
+# points of the first quadrant, where a loser's checker makes a backgammon
+FIRST_QUADRANT = 6
+
+# names of the network outputs, all from the side of players[1]: winning,
+# winning a gammon or a backgammon, losing a gammon or a backgammon.
+# Networks have the first output only or all of them.
+OUTPUTS = ['win', 'win_gammon', 'win_backgammon', 'lose_gammon', 'lose_backgammon']
+
+class FeatureEncoder(object):
+    """
+    Maps boards to network inputs of a fixed width.
+
+    encode is the shared batched pipeline: it lays out the [N, width]
+    float32 output, written into a preallocated buffer when given, and
+    sets the last two units to the player to move, while subclasses
+    define fill(boards, num_pieces, out) to write the board units of the
+    whole batch into out.
+
+    Every board unit depends on the checker count of a single slot, so
+    an input row is the sum of the units of its occupied slots, which
+    slot_features tabulates by slot and count and encode_sparse indexes.
+    """
+
+    name = None
+    width = None
+
+    def __init__(self):
+        self._slot_features = {}
+
+    def encode(self, boards, turns, num_pieces=(15, 15), out=None):
+        """
+        Featurize a stack of boards at once.
+
+        boards is an [N, 28] integer array in the CompactGame layout, turns is
+        the index into game.players of the player to move (a scalar or an [N]
+        array) and num_pieces the checkers per player. Returns an [N, width]
+        float32 array matching Game.extract_features row for row, written into
+        out when a preallocated buffer is given.
+        """
+        boards = np.asarray(boards).reshape(-1, BOARD_SIZE)
+        n = boards.shape[0]
+        if out is None:
+            out = np.empty((n, self.width), dtype=np.float32)
+        else:
+            out = out[:n]
+
+        self.fill(boards, num_pieces, out)
+
+        turns = np.asarray(turns)
+        np.equal(turns, 0, out=out[:, -2], casting='unsafe')
+        np.equal(turns, 1, out=out[:, -1], casting='unsafe')
+        return out
+
+    def slot_features(self, num_pieces=(15, 15)):
+        """
+        [NUM_SLOTS * (MAX_CHECKERS + 1), width] board units of each slot
+        holding each count of checkers, the row of slot s with c checkers
+        being s * (MAX_CHECKERS + 1) + c. Empty slots have all-zero rows.
+        """
+        num_pieces = tuple(num_pieces)
+        if num_pieces not in self._slot_features:
+            counts = np.zeros((NUM_SLOTS, MAX_CHECKERS + 1, NUM_SLOTS), dtype=np.int32)
+            counts[np.arange(NUM_SLOTS), :, np.arange(NUM_SLOTS)] = np.arange(MAX_CHECKERS + 1)
+            boards = slot_boards(counts.reshape(-1, NUM_SLOTS))
+            features = self.encode(boards, 0, num_pieces).reshape(NUM_SLOTS, MAX_CHECKERS + 1, self.width)
+            features -= features[:, :1]
+            self._slot_features[num_pieces] = features.reshape(-1, self.width)
+        return self._slot_features[num_pieces]
+
+    def encode_sparse(self, boards):
+        """
+        Active inputs of a stack of boards: an [N, k] array of the
+        slot_features rows of each board's occupied slots, k being the
+        most any board occupies. Shorter rows are padded with row 0, the
+        empty first slot, so summing the slot_features rows of a board
+        gives the same board units as encode.
+        """
+        counts = slot_counts(boards).reshape(-1, NUM_SLOTS)
+        occupied = counts > 0
+        k = occupied.sum(axis=1).max() if len(counts) else 0
+        # occupied slots first, in slot order
+        slots = np.argsort(~occupied, axis=1, kind='mergesort')[:, :k]
+        rows = np.arange(len(counts))[:, None]
+        return np.where(occupied[rows, slots], slots * (MAX_CHECKERS + 1) + counts[rows, slots], 0)
+
+class CompactEncoder(FeatureEncoder):
+    """
+    The encoding of the TD-Gammon paper: per player, a truncated unary
+    encoding of each point, the bar count over 2 and the fraction of
+    checkers borne off.
+    """
+
+    name = 'compact'
+    width = NUM_FEATURES
+
+    def fill(self, boards, num_pieces, out):
+        n = boards.shape[0]
+        points = boards[:, :NUM_POINTS].astype(np.int32)
+        counts = (np.maximum(points, 0), np.maximum(-points, 0))
+
+        for p in range(2):
+            base = p * PLAYER_FEATURES
+            units = out[:, base:base + POINT_FEATURES].reshape(n, NUM_POINTS, UNITS)
+            np.subtract(counts[p][:, :, None], _OFFSETS, out=units, casting='unsafe')
+            np.clip(units[:, :, :UNITS - 1], 0., 1., out=units[:, :, :UNITS - 1])
+            np.maximum(units[:, :, UNITS - 1], 0., out=units[:, :, UNITS - 1])
+            np.divide(boards[:, NUM_POINTS + p], 2., out=out[:, base + POINT_FEATURES], casting='unsafe')
+            np.divide(boards[:, NUM_POINTS + 2 + p], float(num_pieces[p]), out=out[:, base + POINT_FEATURES + 1], casting='unsafe')
+
+class FullEncoder(FeatureEncoder):
+    """
+    One-hot encoding of the exact checker count of every point, the bar
+    and the borne off checkers of each player, so that distinct positions
+    never share an input.
+    """
+
+    name = 'full'
+    width = 2 * (BOARD_SIZE - 2) * MAX_CHECKERS + 2
+
+    def fill(self, boards, num_pieces, out):
+        n = boards.shape[0]
+        units = out[:, :-2].reshape(n, 2, SLOTS, MAX_CHECKERS)
+        np.equal(slot_counts(boards)[:, :, :, None], _COUNTS, out=units, casting='unsafe')
+
+def slot_counts(boards):
+    """
+    [N, 2, SLOTS] checker counts of each player's 24 points, bar and off
+    tray, for an [N, 28] stack of boards.
+    """
+    boards = np.asarray(boards).reshape(-1, BOARD_SIZE)
+    counts = np.empty((boards.shape[0], 2, SLOTS), dtype=np.int32)
+    points = boards[:, :NUM_POINTS]
+    np.maximum(points, 0, out=counts[:, 0, :NUM_POINTS])
+    np.maximum(np.negative(points), 0, out=counts[:, 1, :NUM_POINTS])
+    counts[:, :, NUM_POINTS] = boards[:, NUM_POINTS:NUM_POINTS + 2]
+    counts[:, :, NUM_POINTS + 1] = boards[:, NUM_POINTS + 2:NUM_POINTS + 4]
+    return counts
+
+def slot_boards(counts):
+    """
+    Boards in the CompactGame layout for [N, NUM_SLOTS] slot counts, the
+    inverse of slot_counts for positions where no point holds checkers
+    of both players.
+    """
+    counts = np.asarray(counts).reshape(-1, 2, SLOTS)
+    boards = np.empty((counts.shape[0], BOARD_SIZE), dtype=np.int8)
+    boards[:, :NUM_POINTS] = counts[:, 0, :NUM_POINTS] - counts[:, 1, :NUM_POINTS]
+    boards[:, NUM_POINTS:NUM_POINTS + 2] = counts[:, :, NUM_POINTS]
+    boards[:, NUM_POINTS + 2:] = counts[:, :, NUM_POINTS + 1]
+    return boards
+
+ENCODERS = dict((encoder.name, encoder) for encoder in [CompactEncoder(), FullEncoder()])
+COMPACT = ENCODERS['compact']
+
+def get_encoder(name):
+    if name not in ENCODERS:
+        raise ValueError('Unknown feature encoder {0}, expected one of {1}'.format(name, ', '.join(sorted(ENCODERS))))
+    return ENCODERS[name]
+
+def encoder_for_width(width):
+    """
+    The encoder whose inputs a network with width input units takes.
+    """
+    for encoder in ENCODERS.values():
+        if encoder.width == width:
+            return encoder
+    raise ValueError('No feature encoder with {0} units'.format(width))
+
+def extract_features_batch(boards, turns, num_pieces=(15, 15), out=None):
+    """
+    Featurize a stack of boards with the compact encoding, see FeatureEncoder.encode.
+    """
+    return COMPACT.encode(boards, turns, num_pieces, out)
+
+def game_outcomes(boards, winners, outputs=len(OUTPUTS)):
+    """
+    Targets of the network outputs for finished games, see OUTPUTS:
+    whether players[1] won, whether it won a gammon, the loser having
+    borne off no checkers, or a backgammon, the loser also having a
+    checker on the bar or in the first quadrant, and whether players[0]
+    won a gammon or a backgammon. boards are the final positions, the
+    first outputs columns are returned.
+    """
+    boards = np.asarray(boards).reshape(-1, BOARD_SIZE)
+    winners = np.asarray(winners).reshape(-1)
+    loser = 1 - winners
+    sign = np.where(loser == 0, 1, -1)[:, None]
+    rows = np.arange(len(boards))
+    gammon = boards[rows, NUM_POINTS + 2 + loser] == 0
+    behind = np.any(boards[:, :FIRST_QUADRANT] * sign > 0, axis=1) | (boards[rows, NUM_POINTS + loser] > 0)
+    backgammon = gammon & behind
+    won = winners == 1
+    targets = np.stack([won, gammon & won, backgammon & won, gammon & ~won, backgammon & ~won], axis=1).astype(np.float32)
+    return targets[:, :outputs]
+
+def cubeless_equity(outputs):
+    """
+    Cubeless equity of players[1], the points it wins on average, for
+    [N, k] network outputs or game_outcomes targets. A gammon counts 2
+    and a backgammon 3; a single output network has no gammons.
+    """
+    outputs = np.asarray(outputs, dtype=np.float64)
+    outputs = outputs.reshape(len(outputs), -1)
+    equity = 2. * outputs[:, 0] - 1.
+    if outputs.shape[1] > 1:
+        equity += outputs[:, 1] + outputs[:, 2] - outputs[:, 3] - outputs[:, 4]
+    return equity
+
+def equity_value(outputs):
+    """
+    cubeless_equity mapped to (equity + 1) / 2, the value moves are
+    picked by. For a single output it is the output, P(players[1] wins),
+    and for either network the value of players[0] is 1 minus it.
+    """
+    return (cubeless_equity(outputs) + 1.) / 2.
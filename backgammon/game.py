@@ -4,6 +4,36 @@ import time
 import random
 import numpy as np
 
+from .features import BOARD_SIZE, COMPACT, game_outcomes
+from .profiling import PROFILER
+from .movegen import generate_moves
+
+class AfterstateSet(object):
+    """
+    Stands in for the move set filled by Game.find_moves, keeping only
+    the first move found for each distinct resulting position.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.keys = set()
+        self.moves = []
+        self.boards = []
+
+    def __len__(self):
+        return len(self.moves)
+
+    def add(self, move):
+        # find_moves calls this with the move applied to the board
+        key = self.game.position_key()
+        if key not in self.keys:
+            self.keys.add(key)
+            self.moves.append(move)
+            self.boards.append(np.array(self.game.encode(), dtype=np.int8))
+
+    def get_boards(self):
+        return np.array(self.boards, dtype=np.int8).reshape(-1, BOARD_SIZE)
+
 class Game:
 
     LAYOUT = "0-2-o,5-5-x,7-3-x,11-5-o,12-5-x,16-3-o,18-5-o,23-2-x"
@@ -13,6 +43,11 @@ class Game:
     ON = 'on'
     TOKENS = ['x', 'o']
 
+    # optional backgammon.cache.MoveCache shared by games created with Game.new
+    move_cache = None
+    # optional backgammon.records.GameRecord that take_turn adds every ply to
+    record = None
+
     def __init__(self, layout=LAYOUT, grid=None, off_pieces=None, bar_pieces=None, num_pieces=None, players=None):
         """
         Define a new game object
@@ -25,6 +60,7 @@ class Game:
             self.bar_pieces = copy.deepcopy(bar_pieces)
             self.num_pieces = copy.deepcopy(num_pieces)
             self.players = players
+            self.count_pips()
             return
         self.players = Game.TOKENS
         self.grid = [[] for _ in range(Game.NUMCOLS)]
@@ -35,29 +71,95 @@ class Game:
             self.bar_pieces[t] = []
             self.off_pieces[t] = []
             self.num_pieces[t] = 0
+        self.count_pips()
 
     @staticmethod
-    def new():
+    def new(move_cache=None, compact=False):
+        """
+        A game in the starting position. With compact, a CompactGame,
+        which plays the same moves from a flat board buffer and is
+        cheaper to clone and to keep many of.
+        """
+        if compact:
+            from .compact_game import CompactGame
+            return CompactGame.new(move_cache)
         game = Game()
         game.reset()
+        game.move_cache = move_cache
         return game
 
-    def extract_features(self, player):
-        features = []
-        for p in self.players:
-            for col in self.grid:
-                feats = [0.] * 6
-                if len(col) > 0 and col[0] == p:
-                    for i in range(len(col)):
-                        feats[min(i, 5)] += 1
-                features += feats
-            features.append(float(len(self.bar_pieces[p])) / 2.)
-            features.append(float(len(self.off_pieces[p])) / self.num_pieces[p])
-        if player == self.players[0]:
-            features += [1., 0.]
-        else:
-            features += [0., 1.]
-        return np.array(features).reshape(1, -1)
+    def encode(self):
+        """
+        Return the position as a list of 28 signed checker counts
+        in the layout described in backgammon.features.
+        """
+        board = [0] * BOARD_SIZE
+        for i, col in enumerate(self.grid):
+            if col:
+                board[i] = len(col) if col[0] == self.players[0] else -len(col)
+        for n, t in enumerate(self.players):
+            board[Game.NUMCOLS + n] = len(self.bar_pieces[t])
+            board[Game.NUMCOLS + 2 + n] = len(self.off_pieces[t])
+        return board
+
+    def position_key(self):
+        """
+        Hashable key identifying the position.
+        """
+        return tuple(self.encode())
+
+    def piece_counts(self):
+        return (self.num_pieces[self.players[0]], self.num_pieces[self.players[1]])
+
+    def extract_features(self, player, encoder=COMPACT):
+        start = time.time()
+        features = encoder.encode(self.encode(), self.players.index(player), self.piece_counts())
+        PROFILER.add_time('featurize', start)
+        return features
+
+    def count_pips(self):
+        """
+        Recompute each player's pip count and number of checkers outside
+        the home board, which take_action and undo_action then keep up to date.
+        """
+        self.pips = dict((t, 0) for t in self.players)
+        self.outside = dict((t, 0) for t in self.players)
+        for i, col in enumerate(self.grid):
+            for piece in col:
+                self.pips[piece] += Game.NUMCOLS - i
+                if i < Game.NUMCOLS - self.die:
+                    self.outside[piece] += 1
+        for t in self.players:
+            self.pips[t] += (Game.NUMCOLS + 1) * len(self.bar_pieces[t])
+            self.outside[t] += len(self.bar_pieces[t])
+        self.update_contact()
+
+    def update_contact(self):
+        """
+        Both sides travel to the same home board, so the position is only
+        treated as a race (no contact) once neither side has a checker
+        outside of it or on the bar.
+        """
+        self.contact = any(self.outside.values())
+
+    def update_pips(self, token, s, e, hit, sign):
+        """
+        Account for token moving a checker from s to e (sign 1) or
+        taking the move back (sign -1), hitting a blot on e if hit.
+        """
+        home = Game.NUMCOLS - self.die
+        start = -1 if s == Game.ON else s
+        end = Game.NUMCOLS if e == Game.OFF else e
+        self.pips[token] -= sign * (end - start)
+        if start < home:
+            self.outside[token] -= sign
+        if end < home:
+            self.outside[token] += sign
+        if hit:
+            opponent = self.opponent(token)
+            self.pips[opponent] += sign * (end + 1)
+            if end >= home:
+                self.outside[opponent] += sign
 
     def roll_dice(self):
         return (random.randint(1, self.die), random.randint(1, self.die))
@@ -67,6 +169,8 @@ class Game:
         while not self.is_over():
             self.next_step(players[player_num], player_num, draw=draw)
             player_num = (player_num + 1) % 2
+            PROFILER.count('plies')
+        PROFILER.count('games')
         return self.winner()
 
     def next_step(self, player, player_num, draw=False):
@@ -82,8 +186,28 @@ class Game:
             print("Player %s rolled <%d, %d>." % (player.player, roll[0], roll[1]))
             time.sleep(1)
 
-        moves = self.get_actions(roll, player.player, nodups=True)
-        move = player.get_action(moves, self) if moves else None
+        start = time.time()
+        # agents that score positions can pick from the distinct afterstates directly
+        if getattr(player, 'uses_afterstates', False):
+            if self.move_cache is not None:
+                moves, boards = self.move_cache.get_afterstates(self, roll, player.player)
+            else:
+                moves, boards = self.get_afterstates(roll, player.player)
+            PROFILER.add_time('move_generation', start)
+            move = player.get_afterstate_action(moves, boards, self) if moves else None
+        else:
+            if self.move_cache is not None:
+                moves = self.move_cache.get_actions(self, roll, player.player, nodups=True)
+            else:
+                moves = self.get_actions(roll, player.player, nodups=True)
+            PROFILER.add_time('move_generation', start)
+            move = player.get_action(moves, self) if moves else None
+        PROFILER.count('turns')
+        PROFILER.count('moves', len(moves))
+
+        if self.record is not None:
+            value = getattr(player, 'value', None) if move else None
+            self.record.add(self.encode(), self.players.index(player.player), roll, move, value)
 
         if move:
             self.take_action(move, player.player)
@@ -109,12 +233,14 @@ class Game:
                 piece = self.grid[s].pop()
             if e == Game.OFF:
                 self.off_pieces[token].append(piece)
-                continue
-            if len(self.grid[e]) > 0 and self.grid[e][0] != token:
-                bar_piece = self.grid[e].pop()
-                self.bar_pieces[bar_piece].append(bar_piece)
-                ateList[i] = 1
-            self.grid[e].append(piece)
+            else:
+                if len(self.grid[e]) > 0 and self.grid[e][0] != token:
+                    bar_piece = self.grid[e].pop()
+                    self.bar_pieces[bar_piece].append(bar_piece)
+                    ateList[i] = 1
+                self.grid[e].append(piece)
+            self.update_pips(token, s, e, ateList[i], 1)
+        self.update_contact()
         return ateList
 
     def undo_action(self, action, player, ateList):
@@ -134,13 +260,33 @@ class Game:
                 self.bar_pieces[player].append(piece)
             else:
                 self.grid[s].append(piece)
+            self.update_pips(player, s, e, ateList[len(action) - 1 - i], -1)
+        self.update_contact()
 
 
     def get_actions(self, roll, player, nodups=False):
         """
-        Get set of all possible move tuples
+        Get set of all possible move tuples, doubles only list one
+        ordering of the same die moves (see backgammon.movegen)
+        """
+        moves, _ = generate_moves(self.encode(), self.players.index(player), roll, on=Game.ON, off=Game.OFF)
+        return set(moves)
+
+    def get_afterstates(self, roll, player):
+        """
+        Get one move per distinct resulting position, as a list of move
+        tuples and an [N, 28] array of the encoded afterstates.
+        """
+        moves, afterstates = generate_moves(self.encode(), self.players.index(player), roll, \
+            unique=True, on=Game.ON, off=Game.OFF)
+        return moves, np.array(afterstates, dtype=np.int8).reshape(-1, BOARD_SIZE)
+
+    def collect_moves(self, roll, player, moves, nodups=False):
+        """
+        Add every possible move tuple to moves with the recursive
+        generator get_actions used to be built on, kept as the
+        reference for backgammon.movegen
         """
-        moves = set()
         if nodups:
             start = 0
         else:
@@ -175,6 +321,7 @@ class Game:
                 bar_piece = None
                 if len(self.grid[r - 1]) == 1 and self.grid[r - 1][-1]!=player:
                     bar_piece = self.grid[r - 1].pop()
+                    self.bar_pieces[bar_piece].append(bar_piece)
 
                 self.grid[r - 1].append(piece)
 
@@ -182,7 +329,7 @@ class Game:
                 self.grid[r - 1].pop()
                 self.bar_pieces[player].append(piece)
                 if bar_piece:
-                    self.grid[r - 1].append(bar_piece)
+                    self.grid[r - 1].append(self.bar_pieces[bar_piece].pop())
             return
 
         # otherwise check each grid location for valid move using r
@@ -197,12 +344,13 @@ class Game:
                 bar_piece = None
                 if len(self.grid[i+r]) == 1 and self.grid[i+r][-1] != player:
                     bar_piece = self.grid[i + r].pop()
+                    self.bar_pieces[bar_piece].append(bar_piece)
                 self.grid[i + r].append(piece)
                 self.find_moves(rs, player, move + ((i, i + r), ), moves, start)
                 self.grid[i + r].pop()
                 self.grid[i].append(piece)
                 if bar_piece:
-                    self.grid[i + r].append(bar_piece)
+                    self.grid[i + r].append(self.bar_pieces[bar_piece].pop())
 
             # If we can't move on the board can we take the piece off?
             if offboarding and self.remove_piece(player, i, r):
@@ -239,6 +387,7 @@ class Game:
         """
         self.grid.reverse()
         self.players.reverse()
+        self.count_pips()
 
     def reset(self):
         """
@@ -250,6 +399,7 @@ class Game:
         for col in self.grid:
             for piece in col:
                 self.num_pieces[piece] += 1
+        self.count_pips()
 
     def winner(self):
         """
@@ -257,6 +407,20 @@ class Game:
         """
         return 0 if len(self.off_pieces[self.players[0]]) == self.num_pieces[self.players[0]] else 1
 
+    def is_gammon(self):
+        """
+        Checks if the game was won before the loser bore off any pieces.
+        """
+        loser = self.players[1 - self.winner()]
+        return self.is_over() and len(self.off_pieces[loser]) == 0
+
+    def outcome(self, outputs=1):
+        """
+        Targets of the first outputs network outputs for the finished
+        game, see backgammon.features.game_outcomes.
+        """
+        return game_outcomes(self.encode(), self.winner(), outputs)[0]
+
     def is_over(self):
         """
         Checks if the game is over.
@@ -299,7 +463,7 @@ class Game:
             return True
         if start + r > Game.NUMCOLS:
             for i in range(start - 1, Game.NUMCOLS - self.die - 1, -1):
-                if len(self.grid[i]) != 0 and self.grid[i][0] == self.players[0]:
+                if len(self.grid[i]) != 0 and self.grid[i][0] == player:
                     return False
             return True
         return False
@@ -0,0 +1,215 @@
+import threading
+
+from .features import BOARD_SIZE, NUM_POINTS
+
+# first point of the home board, both players bear off from points 18 to 23
+HOME = NUM_POINTS - 6
+BAR = NUM_POINTS
+OFF = NUM_POINTS + 2
+MAX_DICE = 4
+
+class MoveGenerator(object):
+    """
+    Iterative legal move generator over the 28 signed counts of
+    Game.encode, following the rules of Game.find_moves.
+
+    The search keeps the board, the die moves made at each depth and
+    the next candidate at each depth in buffers allocated once, and
+    applies and undoes die moves on them in place. Only points the
+    player occupied at the start of the turn or moved a checker to are
+    considered as sources.
+
+    Doubles are enumerated as combinations rather than permutations:
+    each die must move a checker from a point no lower than the one
+    before it. Moving the back checkers first never makes a later die
+    move illegal, so every afterstate is still reached, but by a single
+    ordering of its die moves.
+    """
+
+    def __init__(self, on='on', off='off'):
+        self.on = on
+        self.off = off
+        self.board = [0] * BOARD_SIZE
+        # die move made at each depth, -1 is the bar and NUM_POINTS off
+        self.starts = [0] * MAX_DICE
+        self.ends = [0] * MAX_DICE
+        self.hits = [False] * MAX_DICE
+        # legal die moves and the next one to try at each depth
+        self.actions = [[] for _ in range(MAX_DICE)]
+        self.cursors = [0] * MAX_DICE
+        # points the player occupies at the start of the turn, then at a depth
+        self.root_sources = []
+        self.points = []
+
+    def generate(self, board, turn, roll, unique=False):
+        """
+        Legal moves of the player at index turn for roll, as move tuples
+        like Game.get_actions. With unique, only the first move to each
+        distinct afterstate is kept, and the afterstates are returned
+        along with the moves as tuples of 28 counts.
+        """
+        b = self.board
+        b[:] = board.tolist() if hasattr(board, 'tolist') else board
+        self.turn = turn
+        self.sign = 1 if turn == 0 else -1
+        self.unique = unique
+        self.moves = []
+        self.afterstates = []
+        self.seen = set()
+
+        s = self.sign
+        del self.root_sources[:]
+        self.outside = b[BAR + turn]
+        for i in range(NUM_POINTS):
+            if b[i] * s > 0:
+                self.root_sources.append(i)
+                if i < HOME:
+                    self.outside += b[i] * s
+
+        r1, r2 = roll
+        if r1 == r2:
+            # keep trying until we find some moves
+            for n in range(MAX_DICE, 0, -1):
+                self.search((r1, ) * n, True)
+                if self.moves:
+                    break
+        else:
+            self.search((r1, r2), False)
+            self.search((r2, r1), False)
+            # has no moves, try moving only one piece
+            if not self.moves:
+                for r in roll:
+                    self.search((r, ), False)
+
+        return self.moves, self.afterstates
+
+    def search(self, dice, canonical):
+        n = len(dice)
+        actions, cursors = self.actions, self.cursors
+        d = 0
+        self.prepare(0, dice[0], canonical)
+        while True:
+            if cursors[d] < len(actions[d]):
+                source = actions[d][cursors[d]]
+                cursors[d] += 1
+                self.apply(d, source, dice[d])
+                if d + 1 == n:
+                    self.emit(n)
+                    self.undo(d)
+                else:
+                    d += 1
+                    self.prepare(d, dice[d], canonical)
+            elif d == 0:
+                return
+            else:
+                d -= 1
+                self.undo(d)
+
+    def prepare(self, d, r, canonical):
+        """
+        Fill in the legal die moves for r at depth d, by their source
+        point in ascending order. A checker on the bar must enter first
+        (source -1). A point's checker can either move on or bear off
+        with r, never both.
+        """
+        b = self.board
+        s = self.sign
+        actions = self.actions[d]
+        del actions[:]
+        self.cursors[d] = 0
+
+        if b[BAR + self.turn] > 0:
+            if b[r - 1] * s >= -1:
+                actions.append(-1)
+            return
+
+        points = self.root_sources
+        if d:
+            points = self.points
+            del points[:]
+            points.extend(self.root_sources)
+            for e in self.ends[:d]:
+                if e < NUM_POINTS and e not in points:
+                    points.append(e)
+
+        lowest = self.starts[d - 1] if canonical and d else -1
+        offboarding = self.outside == 0
+        for i in points:
+            if i < lowest or b[i] * s <= 0:
+                continue
+            e = i + r
+            if e < NUM_POINTS:
+                if b[e] * s >= -1:
+                    actions.append(i)
+            elif offboarding and i >= HOME:
+                # a higher die only bears off from the farthest point
+                if e == NUM_POINTS or not any(b[j] * s > 0 for j in range(HOME, i)):
+                    actions.append(i)
+        if d:
+            actions.sort()
+
+    def apply(self, d, source, r):
+        b = self.board
+        s = self.sign
+        t = self.turn
+        if source < 0:
+            start, end = -1, r - 1
+            b[BAR + t] -= 1
+        else:
+            start, end = source, min(source + r, NUM_POINTS)
+            b[start] -= s
+        hit = False
+        if end < NUM_POINTS:
+            if b[end] * s == -1:
+                hit = True
+                b[end] = 0
+                b[BAR + 1 - t] += 1
+            b[end] += s
+        else:
+            b[OFF + t] += 1
+        if start < HOME and end >= HOME:
+            self.outside -= 1
+        self.starts[d] = start
+        self.ends[d] = end
+        self.hits[d] = hit
+
+    def undo(self, d):
+        b = self.board
+        s = self.sign
+        t = self.turn
+        start, end = self.starts[d], self.ends[d]
+        if end < NUM_POINTS:
+            b[end] -= s
+            if self.hits[d]:
+                b[end] = -s
+                b[BAR + 1 - t] -= 1
+        else:
+            b[OFF + t] -= 1
+        if start < 0:
+            b[BAR + t] += 1
+        else:
+            b[start] += s
+        if start < HOME and end >= HOME:
+            self.outside += 1
+
+    def emit(self, n):
+        if self.unique:
+            key = tuple(self.board)
+            if key in self.seen:
+                return
+            self.seen.add(key)
+            self.afterstates.append(key)
+        starts, ends = self.starts, self.ends
+        self.moves.append(tuple([(self.on if starts[k] < 0 else starts[k], \
+            self.off if ends[k] >= NUM_POINTS else ends[k]) for k in range(n)]))
+
+_local = threading.local()
+
+def generate_moves(board, turn, roll, unique=False, on='on', off='off'):
+    """
+    MoveGenerator.generate with a generator kept per thread.
+    """
+    generator = getattr(_local, 'generator', None)
+    if generator is None:
+        generator = _local.generator = MoveGenerator(on, off)
+    return generator.generate(board, turn, roll, unique)
@@ -0,0 +1,105 @@
+from __future__ import division
+
+import time
+import json
+import cProfile
+import contextlib
+from collections import defaultdict
+
+class Profiler(object):
+    """
+    Wall-clock time per phase and event counters for games and training.
+
+    Phases are timed by the caller around each section, which costs two
+    clock reads, so the hot paths stay instrumented all the time:
+
+        start = time.time()
+        ...
+        PROFILER.add_time('inference', start)
+
+    Phases are meant not to overlap, so their shares of the elapsed
+    time add up to at most one.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.start_time = time.time()
+
+    def add_time(self, phase, start):
+        self.times[phase] += time.time() - start
+        self.calls[phase] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def stats(self):
+        """
+        Totals since the last reset along with rates per second and per turn.
+        """
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        turns = max(self.counters['turns'], 1)
+        stats = {
+            'elapsed': elapsed,
+            'games_per_sec': self.counters['games'] / elapsed,
+            'plies_per_sec': self.counters['plies'] / elapsed,
+            'moves_per_turn': self.counters['moves'] / turns,
+            'evaluations_per_turn': self.counters['evaluations'] / turns,
+        }
+        for name, n in self.counters.items():
+            stats[name] = n
+        for phase, seconds in self.times.items():
+            stats[phase + '_sec'] = seconds
+            stats[phase + '_share'] = seconds / elapsed
+            stats[phase + '_ms_per_call'] = 1000. * seconds / self.calls[phase]
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        phases = ', '.join('%s %.1f%%' % (phase, stats[phase + '_share'] * 100.0) \
+            for phase in sorted(self.times, key=self.times.get, reverse=True))
+        return "%.2f games/s, %.1f plies/s, %.1f moves and %.1f evaluations per turn (%s)" % ( \
+            stats['games_per_sec'], stats['plies_per_sec'], \
+            stats['moves_per_turn'], stats['evaluations_per_turn'], phases)
+
+    def write(self, path):
+        """
+        Append the current stats to the JSON lines file at path.
+        """
+        stats = self.stats()
+        stats['time'] = time.time()
+        with open(path, 'a') as f:
+            f.write(json.dumps(stats, sort_keys=True) + '\n')
+
+    def write_summaries(self, summary_writer, global_step):
+        """
+        Add the rates and phase shares as scalar summaries under profile/.
+        """
+        import tensorflow as tf
+        values = [tf.Summary.Value(tag='profile/' + name, simple_value=float(value)) \
+            for name, value in self.stats().items() if not name.endswith('_sec')]
+        summary_writer.add_summary(tf.Summary(value=values), global_step=global_step)
+
+# shared by the game, agents and training loop of a process
+PROFILER = Profiler()
+
+@contextlib.contextmanager
+def cprofile(path=None):
+    """
+    Run the body under cProfile and dump the stats to path, does
+    nothing without a path.
+    """
+    if not path:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
@@ -0,0 +1,96 @@
+from __future__ import division
+
+import math
+import numpy as np
+
+from .bearoff import BearoffDatabase, no_contact
+from .features import BOARD_SIZE, NUM_POINTS
+
+# mean and variance of the pips moved by a single roll, doubles counting four times
+ROLL_MEAN = 49. / 6.
+ROLL_VARIANCE = 18.4722
+
+# pips lost per checker left to bear off, fit against the bear-off database
+WASTAGE = 3.5
+
+_DISTANCES = np.arange(NUM_POINTS, 0, -1)
+
+def _normal_cdf(x):
+    erf = np.vectorize(math.erf, otypes=[np.float64])
+    return 0.5 * (1. + erf(np.asarray(x) / math.sqrt(2.)))
+
+def pip_counts(boards):
+    """
+    Pip counts of both players for an [N, 28] stack of boards as an
+    [N, 2] array, in the order of game.players.
+    """
+    boards = np.asarray(boards, dtype=np.int64).reshape(-1, BOARD_SIZE)
+    points = boards[:, :NUM_POINTS]
+    bar = boards[:, NUM_POINTS:NUM_POINTS + 2]
+    pips = np.empty((len(boards), 2), dtype=np.int64)
+    pips[:, 0] = np.dot(np.maximum(points, 0), _DISTANCES)
+    pips[:, 1] = np.dot(np.maximum(-points, 0), _DISTANCES)
+    return pips + (NUM_POINTS + 1) * bar
+
+def checker_counts(boards):
+    """
+    Checkers not yet borne off of both players for an [N, 28] stack of
+    boards as an [N, 2] array, in the order of game.players.
+    """
+    boards = np.asarray(boards, dtype=np.int64).reshape(-1, BOARD_SIZE)
+    points = boards[:, :NUM_POINTS]
+    counts = np.empty((len(boards), 2), dtype=np.int64)
+    counts[:, 0] = np.sum(np.maximum(points, 0), axis=1)
+    counts[:, 1] = np.sum(np.maximum(-points, 0), axis=1)
+    return counts + boards[:, NUM_POINTS:NUM_POINTS + 2]
+
+class RaceEvaluator(object):
+    """
+    Scores positions without contact instead of the network.
+
+    Both sides travel to the same home board in this game, so contact is
+    only broken once neither side has a checker outside of it or on the
+    bar and no blot can be hit by a checker behind it (see no_contact).
+    Blots can still be left later in the bear-off, which these values
+    don't account for. With a BearoffDatabase the values come from the
+    exact one-sided distributions, otherwise from a normal approximation
+    of the number of rolls each side needs to cover its pip count plus
+    the pips wasted bearing off.
+    """
+
+    def __init__(self, bearoff=None):
+        self.bearoff = bearoff
+
+    @staticmethod
+    def load(bearoff_path=None):
+        """
+        Race evaluator backed by the bear-off database at bearoff_path
+        when given (built on first use if missing).
+        """
+        return RaceEvaluator(BearoffDatabase.load(bearoff_path) if bearoff_path else None)
+
+    def covers(self, boards):
+        """
+        True for each board of an [N, 28] stack without contact, see
+        no_contact.
+        """
+        return no_contact(boards)
+
+    def get_output(self, boards, turn):
+        """
+        P(players[1] wins) for each of an [N, 28] stack of race boards
+        with the player at index turn about to roll, like the network output.
+        """
+        if self.bearoff is not None:
+            return self.bearoff.get_output(boards, turn)
+
+        checkers = checker_counts(boards)
+        pips = pip_counts(boards) + WASTAGE * checkers
+        mover, other = pips[:, turn], pips[:, 1 - turn]
+        # the player to move wins if they need no more rolls than the other side
+        mean = (other - mover) / ROLL_MEAN
+        sd = np.sqrt(np.maximum(mover + other, 1.) * ROLL_VARIANCE / ROLL_MEAN ** 3)
+        p = _normal_cdf((mean + 0.5) / sd)
+        # a side without checkers left has already won
+        p = np.where(checkers[:, 1 - turn] == 0, 0., np.where(checkers[:, turn] == 0, 1., p))
+        return p if turn == 1 else 1. - p
@@ -0,0 +1,218 @@
+from __future__ import division
+
+import os
+import struct
+import Queue
+import threading
+import numpy as np
+
+from .features import BOARD_SIZE, NUM_POINTS
+
+# file header: magic, format version and record size
+MAGIC = b'TDGR'
+VERSION = 2
+HEADER = struct.Struct('<4sII4x')
+
+MAX_DICE = 4
+
+# die moves are stored as (start, end) points, entering from the bar
+# starts at MOVE_ON, bearing off ends at MOVE_OFF, unused die moves are MOVE_NONE
+MOVE_ON = -1
+MOVE_OFF = NUM_POINTS
+MOVE_NONE = -2
+
+# one record per ply: the position before the move with the player at index
+# turn to move, the roll, the move played, the value of the afterstate it was
+# picked with (NaN when the agent doesn't score positions), the winner and
+# whether it is the last ply of its game, so a game cut short by an
+# interrupted writer is never taken for a finished one
+PLY = np.dtype([
+    ('game', '<u4'),
+    ('turn', 'u1'),
+    ('dice', 'u1', (2, )),
+    ('winner', 'u1'),
+    ('board', 'i1', (BOARD_SIZE, )),
+    ('move', 'i1', (MAX_DICE, 2)),
+    ('value', '<f4'),
+    ('last', 'u1'),
+])
+
+def encode_move(move, on='on', off='off'):
+    """
+    Move tuple of Game.get_actions as a [MAX_DICE, 2] array of points,
+    None (no legal move) has no die moves.
+    """
+    encoded = np.full((MAX_DICE, 2), MOVE_NONE, dtype=np.int8)
+    for k, (s, e) in enumerate(move or ()):
+        encoded[k] = (MOVE_ON if s == on else s, MOVE_OFF if e == off else e)
+    return encoded
+
+def decode_move(encoded, on='on', off='off'):
+    """
+    Move tuple from encode_move, or None if it has no die moves.
+    """
+    move = tuple((on if s == MOVE_ON else int(s), off if e == MOVE_OFF else int(e)) \
+        for s, e in encoded.tolist() if s != MOVE_NONE)
+    return move or None
+
+class GameRecord(object):
+    """
+    Plies of a game as it is played, set as Game.record to have
+    Game.take_turn fill it in.
+    """
+
+    def __init__(self):
+        self.plies = []
+
+    def __len__(self):
+        return len(self.plies)
+
+    def add(self, board, turn, roll, move, value=None):
+        # boards are copied, CompactGame.encode returns a view of the live board
+        self.plies.append((np.array(board, dtype=np.int8), turn, roll, encode_move(move), np.nan if value is None else value))
+
+    def to_array(self, winner):
+        """
+        The plies as PLY records, to pass to RecordWriter.add.
+        """
+        plies = np.zeros(len(self.plies), dtype=PLY)
+        if self.plies:
+            boards, turns, dice, moves, values = zip(*self.plies)
+            plies['board'] = boards
+            plies['turn'] = turns
+            plies['dice'] = dice
+            plies['move'] = moves
+            plies['value'] = values
+        plies['winner'] = winner
+        plies['last'][-1:] = 1
+        return plies
+
+def read_header(f):
+    data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise IOError('Truncated game record header')
+    magic, version, itemsize = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION or itemsize != PLY.itemsize:
+        raise IOError('Not a version {0} game record file'.format(VERSION))
+
+class RecordWriter(object):
+    """
+    Appends games to a game record file.
+
+    Games are buffered in memory and written in bulk from a background
+    thread once buffer_plies plies have been added, so the play loop
+    only ever copies the plies of a finished game into the buffer.
+    """
+
+    def __init__(self, path, buffer_plies=1 << 16):
+        self.path = path
+        self.buffer_plies = buffer_plies
+        self.buffer = []
+        self.buffered = 0
+
+        # number the games on after those already in the file
+        self.games = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            reader = RecordReader(path)
+            plies = reader.num_plies()
+            if plies:
+                self.games = int(reader.plies['game'][-1]) + 1
+            del reader
+            # drop the plies of a game left partly written by an interrupted
+            # writer, so the games appended after it stay aligned and whole
+            self.file = open(path, 'r+b')
+            self.file.truncate(HEADER.size + plies * PLY.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(HEADER.pack(MAGIC, VERSION, PLY.itemsize))
+
+        self.chunks = Queue.Queue(maxsize=8)
+        self.thread = threading.Thread(target=self._write)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, plies):
+        """
+        Add a finished game, given as PLY records from GameRecord.to_array.
+        """
+        plies = plies.copy()
+        plies['game'] = self.games
+        self.games += 1
+        self.buffer.append(plies)
+        self.buffered += len(plies)
+        if self.buffered >= self.buffer_plies:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.chunks.put(np.concatenate(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def _write(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+            self.file.write(chunk.tobytes())
+            self.file.flush()
+
+    def close(self):
+        """
+        Write the buffered games and wait for all writes.
+        """
+        self.flush()
+        self.chunks.put(None)
+        self.thread.join()
+        self.file.close()
+
+class RecordReader(object):
+    """
+    Memory-mapped view of a game record file. plies holds the PLY
+    records of all games in the order they finished, indexing the
+    reader gives the plies of a single game. Plies after the last ply
+    of the last finished game, left by an interrupted writer, are
+    ignored.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            read_header(f)
+        # a partly written record at the end is ignored
+        n = (os.path.getsize(path) - HEADER.size) // PLY.itemsize
+        if n:
+            self.plies = np.memmap(path, dtype=PLY, mode='r', offset=HEADER.size, shape=(n, ))
+        else:
+            self.plies = np.zeros(0, dtype=PLY)
+
+        # first ply of each game and the end of the last finished one
+        ends = np.flatnonzero(self.plies['last']) + 1
+        self.plies = self.plies[:ends[-1] if len(ends) else 0]
+        self.bounds = np.append(0, ends)
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('game index out of range')
+        return self.plies[self.bounds[i]:self.bounds[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def num_plies(self):
+        return len(self.plies)
+
+    def winners(self):
+        return self.plies['winner'][self.bounds[:-1]]
+
+    def moves(self, i, on='on', off='off'):
+        """
+        Move tuples played in game i, None for a turn without a legal move.
+        """
+        return [decode_move(move, on, off) for move in self[i]['move']]
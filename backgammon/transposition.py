@@ -0,0 +1,141 @@
+import time
+import numpy as np
+
+from .cache import LRUCache
+from .features import BOARD_SIZE, NUM_POINTS, equity_value
+from .profiling import PROFILER
+
+# boards hold at most 15 checkers per slot, points are signed
+MAX_CHECKERS = 15
+
+def _zobrist_keys(seed=0x7d9a):
+    """
+    Random 64-bit key per (board slot, signed count). An empty slot
+    has a zero key so it doesn't contribute to the hash.
+    """
+    rng = np.random.RandomState(seed)
+    keys = rng.randint(0, 2 ** 62, size=(BOARD_SIZE, 2 * MAX_CHECKERS + 1, 2)).astype(np.uint64)
+    keys = (keys[:, :, 0] << np.uint64(32)) ^ keys[:, :, 1]
+    keys[:, MAX_CHECKERS] = 0
+    # bar and off counts are never negative
+    keys[NUM_POINTS:, :MAX_CHECKERS] = 0
+    turns = rng.randint(0, 2 ** 62, size=2).astype(np.uint64)
+    return keys, turns
+
+ZOBRIST_KEYS, ZOBRIST_TURNS = _zobrist_keys()
+_SLOTS = np.arange(BOARD_SIZE)
+
+def zobrist_hash(boards, turn):
+    """
+    64-bit Zobrist hashes of an [N, 28] stack of boards with the player
+    at index turn of game.players to move. turn may be a scalar or an
+    [N] array.
+    """
+    boards = np.asarray(boards).reshape(-1, BOARD_SIZE).astype(np.int64)
+    hashes = np.bitwise_xor.reduce(ZOBRIST_KEYS[_SLOTS, boards + MAX_CHECKERS], axis=1)
+    return hashes ^ ZOBRIST_TURNS[turn]
+
+# default number of table entries, a few tens of MB per table, which
+# every searching agent and process builds for itself
+TABLE_SIZE = 1 << 16
+
+class TranspositionTable(LRUCache):
+    """
+    Bounded cache of network values and search results by Zobrist hash.
+
+    Values are stored as the network's output, P(players[1] wins), along
+    with the depth in plies they were searched to (0 for a plain network
+    evaluation); a probe only hits entries searched at least as deep.
+    Entries are only valid for the weights they were computed with, so
+    the table must be cleared whenever the weights change.
+    """
+
+    def __init__(self, capacity=TABLE_SIZE):
+        super(TranspositionTable, self).__init__(capacity)
+
+    def probe(self, key, depth=0):
+        entry = self.get(key)
+        if entry is None or entry[0] < depth:
+            return None
+        return entry[1]
+
+    def store(self, key, value, depth=0):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > depth:
+            return
+        self.put(key, (depth, value))
+
+def evaluate_outputs(model, boards, turn, num_pieces, batch_size=None):
+    """
+    Network outputs, [N, model.outputs], for an [N, 28] stack of boards
+    with the player at index turn to move, featurized with the model's
+    encoder. Forward passes are split into batches of batch_size rows
+    when given. Models with get_output_boards score the boards without
+    featurizing them, and a model's profile_phase names the phase the
+    call is timed under.
+    """
+    boards = np.asarray(boards, dtype=np.int8).reshape(-1, BOARD_SIZE)
+    outputs = np.empty((len(boards), model.outputs))
+    batch_size = batch_size or max(len(boards), 1)
+    # models with a sparse first layer take the boards themselves
+    sparse = hasattr(model, 'get_output_boards')
+    if not sparse:
+        features = np.empty((min(len(boards), batch_size), model.encoder.width), dtype=np.float32)
+    for start in range(0, len(boards), batch_size):
+        batch = boards[start:start + batch_size]
+        clock = time.time()
+        if sparse:
+            outputs[start:start + batch_size] = model.get_output_boards(batch, turn, num_pieces)
+        else:
+            x = model.encoder.encode(batch, turn, num_pieces, out=features)
+            PROFILER.add_time('featurize', clock)
+            clock = time.time()
+            outputs[start:start + batch_size] = model.get_output(x)
+        PROFILER.add_time(getattr(model, 'profile_phase', 'inference'), clock)
+    PROFILER.count('evaluations', len(boards))
+    return outputs
+
+def evaluate_boards(model, boards, turn, num_pieces, table=None, batch_size=None, race=None):
+    """
+    Value of each of an [N, 28] stack of boards with the player at index
+    turn to move: the network's equity_value, which is P(players[1] wins)
+    for a single output network. Every distinct position is scored once,
+    values already in table are reused and new ones are added to it, see
+    evaluate_outputs for the forward passes. With a RaceEvaluator,
+    positions without contact are scored by their winning chances from
+    it instead.
+    """
+    boards = np.asarray(boards, dtype=np.int8).reshape(-1, BOARD_SIZE)
+    if race is not None:
+        covered = race.covers(boards)
+        # pure races skip hashing and the network altogether
+        if np.all(covered):
+            return race.get_output(boards, turn)
+
+    hashes = zobrist_hash(boards, turn)
+    unique, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+
+    values = np.empty(len(unique))
+    missing = np.arange(len(unique))
+    if race is not None:
+        covered = covered[first]
+        if np.any(covered):
+            values[covered] = race.get_output(boards[first[covered]], turn)
+        missing = missing[~covered]
+    if table is not None:
+        uncached = []
+        for i in missing:
+            value = table.probe(int(unique[i]))
+            if value is None:
+                uncached.append(i)
+            else:
+                values[i] = value
+        missing = np.array(uncached, dtype=np.int64)
+
+    if len(missing):
+        values[missing] = equity_value(evaluate_outputs(model, boards[first[missing]], turn, num_pieces, batch_size))
+        if table is not None:
+            for i in missing:
+                table.store(int(unique[i]), float(values[i]))
+
+    return values[inverse]
@@ -0,0 +1,237 @@
+"""
+Benchmarks of move generation, featurization, move selection and full
+games on a fixed, seeded corpus of positions. Results are written as
+JSON so runs can be compared across commits:
+
+    python benchmark.py --output before.json
+
+With --check it verifies instead that the move generator returns the
+same legal moves as the recursive reference generator on the corpus,
+for every roll.
+"""
+from __future__ import division
+
+import sys
+import time
+import json
+import random
+import argparse
+import platform
+import subprocess
+import numpy as np
+
+from backgammon.game import Game
+from backgammon.features import get_encoder
+from backgammon.agents.random_agent import RandomAgent
+from backgammon.agents.td_gammon_agent import TDAgent
+from inference import NumpyModel
+
+CATEGORIES = ['opening', 'contact', 'bar', 'doubles', 'bearoff']
+
+def random_model(seed=0, hidden=(50, ), encoder='compact'):
+    """
+    Network with fixed random weights, so results don't depend on a checkpoint.
+    """
+    rng = np.random.RandomState(seed)
+    sizes = [get_encoder(encoder).width] + list(hidden) + [1]
+    weights = []
+    for n, m in zip(sizes[:-1], sizes[1:]):
+        weights += [rng.randn(n, m) * 0.1, np.full(m, 0.1)]
+    return NumpyModel(weights)
+
+def category(game, player, roll, ply):
+    if ply < 4:
+        return 'opening'
+    if game.bar_pieces[player]:
+        return 'bar'
+    if not game.contact:
+        return 'bearoff'
+    if roll[0] == roll[1]:
+        return 'doubles'
+    return 'contact'
+
+def build_corpus(size=100, seed=0):
+    """
+    Positions reached by seeded random play, size of each category, as
+    (game, player, roll) tuples by category. Random play reaches bear-offs
+    rarely, so games continue until every category is filled.
+    """
+    random.seed(seed)
+    corpus = dict((name, []) for name in CATEGORIES)
+    while any(len(positions) < size for positions in corpus.values()):
+        game = Game.new()
+        players = [RandomAgent(Game.TOKENS[0]), RandomAgent(Game.TOKENS[1])]
+        player_num = random.randint(0, 1)
+        ply = 0
+        while not game.is_over():
+            player = players[player_num].player
+            roll = game.roll_dice()
+            positions = corpus[category(game, player, roll, ply)]
+            if len(positions) < size:
+                positions.append((game.clone(), player, roll))
+            game.take_turn(players[player_num], roll)
+            player_num = (player_num + 1) % 2
+            ply += 1
+    return corpus
+
+def measure(fn, repeat=3):
+    """
+    Best wall-clock time of repeat runs of fn.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        best = min(best, time.time() - start)
+    return best
+
+def bench_positions(corpus, model, repeat=3):
+    results = {}
+    for name in CATEGORIES:
+        positions = corpus[name]
+        n = len(positions)
+        agents = dict((t, TDAgent(t, model)) for t in Game.TOKENS)
+        actions = [game.get_actions(roll, player, nodups=True) for game, player, roll in positions]
+        afterstates = [game.get_afterstates(roll, player)[1] for game, player, roll in positions]
+        boards = np.vstack(afterstates)
+
+        def get_actions():
+            for game, player, roll in positions:
+                game.get_actions(roll, player, nodups=True)
+
+        def get_afterstates():
+            for game, player, roll in positions:
+                game.get_afterstates(roll, player)
+
+        def extract_features():
+            for game, player, roll in positions:
+                game.extract_features(player, model.encoder)
+
+        def extract_features_afterstates():
+            model.encoder.encode(boards, 0)
+
+        def get_action():
+            for (game, player, roll), moves in zip(positions, actions):
+                if moves:
+                    agents[player].get_action(moves, game)
+
+        results[name] = {
+            'positions': n,
+            'moves_per_position': sum(len(a) for a in actions) / n,
+            'afterstates_per_position': len(boards) / n,
+            'get_actions_us': measure(get_actions, repeat) / n * 1e6,
+            'get_afterstates_us': measure(get_afterstates, repeat) / n * 1e6,
+            'extract_features_us': measure(extract_features, repeat) / n * 1e6,
+            'extract_features_afterstates_us': measure(extract_features_afterstates, repeat) / max(len(boards), 1) * 1e6,
+            'get_action_us': measure(get_action, repeat) / n * 1e6,
+        }
+    return results
+
+def bench_games(model, games=20, seed=0):
+    """
+    Self-play games of two TDAgents sharing the network.
+    """
+    random.seed(seed)
+    players = [TDAgent(Game.TOKENS[0], model), TDAgent(Game.TOKENS[1], model)]
+    plies = 0
+    start = time.time()
+    for _ in range(games):
+        game = Game.new()
+        player_num = random.randint(0, 1)
+        while not game.is_over():
+            game.next_step(players[player_num], player_num)
+            player_num = (player_num + 1) % 2
+            plies += 1
+    elapsed = time.time() - start
+    return {
+        'games': games,
+        'plies': plies,
+        'games_per_sec': games / elapsed,
+        'plies_per_sec': plies / elapsed,
+    }
+
+def afterstates(game, moves, player):
+    boards = set()
+    for move in moves:
+        ateList = game.take_action(move, player)
+        boards.add(tuple(game.encode()))
+        game.undo_action(move, player, ateList)
+    return boards
+
+def check_moves(corpus):
+    """
+    Compare Game.get_actions and Game.get_afterstates with the recursive
+    Game.collect_moves for all 21 rolls in every corpus position. Returns
+    a list of mismatch descriptions, empty when they agree.
+    """
+    errors = []
+    rolls = [(a, b) for a in range(1, 7) for b in range(a, 7)]
+    for name in CATEGORIES:
+        for n, (game, player, _) in enumerate(corpus[name]):
+            for roll in rolls:
+                reference = game.collect_moves(roll, player, set())
+                moves = game.get_actions(roll, player)
+                where = '%s #%d %s roll %s' % (name, n, player, roll)
+                # doubles list a single ordering of the same die moves
+                if roll[0] == roll[1]:
+                    if not moves <= reference:
+                        errors.append('%s: illegal moves %s' % (where, sorted(moves - reference)[:3]))
+                elif moves != reference:
+                    errors.append('%s: %d moves, expected %d' % (where, len(moves), len(reference)))
+                expected = afterstates(game, reference, player)
+                if afterstates(game, moves, player) != expected:
+                    errors.append('%s: afterstates of the moves differ' % where)
+                unique, boards = game.get_afterstates(roll, player)
+                if set(map(tuple, boards.tolist())) != expected or len(unique) != len(expected) or \
+                        afterstates(game, unique, player) != expected:
+                    errors.append('%s: get_afterstates differs' % where)
+    return errors
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100, help='Positions per category.')
+    parser.add_argument('--games', type=int, default=20, help='Self-play games for the end-to-end benchmark.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the best is reported.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the corpus, the network and the games.')
+    parser.add_argument('--hidden', default='50', help='Comma-separated hidden layer sizes of the network.')
+    parser.add_argument('--encoder', default='compact', help='Feature encoder of the network inputs.')
+    parser.add_argument('--output', default='', help='Write the results to this file instead of stdout.')
+    parser.add_argument('--check', action='store_true', help='Check the move generator against the reference instead.')
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.size, args.seed)
+    if args.check:
+        errors = check_moves(corpus)
+        for error in errors:
+            print(error)
+        print('%d positions checked, %d mismatches' % (args.size * len(CATEGORIES), len(errors)))
+        sys.exit(1 if errors else 0)
+
+    model = random_model(args.seed, [int(size) for size in args.hidden.split(',') if size], args.encoder)
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'size': args.size,
+        'seed': args.seed,
+        'hidden': args.hidden,
+        'encoder': args.encoder,
+        'positions': bench_positions(corpus, model, args.repeat),
+        'games': bench_games(model, args.games, args.seed),
+    }
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import os
+import time
+import Queue
+import threading
+import tensorflow as tf
+
+from inference import NumpyModel, HISTORY_NAME, weight_history
+
+class CheckpointManager(object):
+    """
+    Writes checkpoints and summaries without stalling training.
+
+    Checkpoints are taken every checkpoint_interval episodes or
+    checkpoint_secs seconds, whichever comes first, so a crash loses at
+    most one interval. The variables are copied out of the session in a
+    single call and saved from a separate graph on a background thread;
+    if the thread is still busy with the previous snapshot, that one is
+    replaced by the newer one.
+
+    With export_path, the network weights are exported for
+    inference.NumpyModel along with every checkpoint, so inference-only
+    processes can load recent weights without TensorFlow. The last
+    keep_checkpoints checkpoints are kept, and with history_path as many
+    exported weights, one file per global step, for tournaments between
+    the stages of training.
+
+    Scalar summaries are written every summary_interval episodes and
+    the weight, gradient and trace histograms every histogram_interval.
+    """
+
+    def __init__(self, sess, summary_writer, checkpoint_path, checkpoint_interval=100, checkpoint_secs=600, \
+            summary_interval=1, histogram_interval=100, summaries_op=None, histograms_op=None, export_path=None, weights=None, \
+            keep_checkpoints=1, history_path=None):
+        self.sess = sess
+        self.summary_writer = summary_writer
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_secs = checkpoint_secs
+        self.summary_interval = summary_interval
+        self.histogram_interval = histogram_interval
+        self.summaries_op = summaries_op
+        self.histograms_op = histograms_op
+
+        # everything the model's saver would save, restored by name
+        self.variables = tf.all_variables()
+        self.names = [var.op.name for var in self.variables]
+
+        # position of the network weights among the variables, in get_weights order
+        self.export_path = export_path
+        self.weight_indices = [[v is w for v in self.variables].index(True) for w in weights or []]
+        self.keep_checkpoints = keep_checkpoints
+        self.history_path = history_path
+        if history_path and not os.path.exists(history_path):
+            os.makedirs(history_path)
+
+        # shadow copies of the variables in their own graph, saved from the writer thread
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.placeholders = []
+            assigns = []
+            shadows = {}
+            for name, var in zip(self.names, self.variables):
+                shadow = tf.Variable(tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype), trainable=False)
+                placeholder = tf.placeholder(var.dtype.base_dtype, var.get_shape())
+                self.placeholders.append(placeholder)
+                assigns.append(shadow.assign(placeholder))
+                shadows[name] = shadow
+            self.assign_op = tf.group(*assigns)
+            self.saver = tf.train.Saver(shadows, max_to_keep=keep_checkpoints)
+            self.shadow_sess = tf.Session(graph=self.graph)
+            self.shadow_sess.run(tf.initialize_all_variables())
+
+        self.snapshots = Queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._write)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.last_episode = 0
+        self.last_time = time.time()
+
+    def summary_fetches(self, episode):
+        """
+        Summary ops to run along with the update at the end of episode.
+        """
+        fetches = []
+        if self.summaries_op is not None and episode % self.summary_interval == 0:
+            fetches.append(self.summaries_op)
+        if self.histograms_op is not None and episode % self.histogram_interval == 0:
+            fetches.append(self.histograms_op)
+        return fetches
+
+    def add_summaries(self, summaries, global_step):
+        for summary in summaries:
+            self.summary_writer.add_summary(summary, global_step=global_step)
+
+    def maybe_save(self, episode, global_step):
+        """
+        Snapshot the variables for a checkpoint when an interval has passed.
+        """
+        if episode - self.last_episode >= self.checkpoint_interval or \
+                time.time() - self.last_time >= self.checkpoint_secs:
+            self.save(episode, global_step)
+
+    def save(self, episode, global_step):
+        values = self.sess.run(self.variables)
+        # never block training, the newest snapshot replaces one still waiting
+        try:
+            self.snapshots.get_nowait()
+            self.snapshots.task_done()
+        except Queue.Empty:
+            pass
+        self.snapshots.put((global_step, values))
+        self.last_episode = episode
+        self.last_time = time.time()
+
+    def _write(self):
+        while True:
+            snapshot = self.snapshots.get()
+            try:
+                if snapshot is None:
+                    return
+                global_step, values = snapshot
+                self.shadow_sess.run(self.assign_op, feed_dict=dict(zip(self.placeholders, values)))
+                self.saver.save(self.shadow_sess, self.checkpoint_path + 'checkpoint', global_step=global_step)
+                weights = NumpyModel([values[i] for i in self.weight_indices]) if self.weight_indices else None
+                if self.export_path:
+                    weights.save(self.export_path)
+                if self.history_path:
+                    weights.save(os.path.join(self.history_path, HISTORY_NAME % global_step))
+                    for _, path in weight_history(self.history_path)[:-self.keep_checkpoints]:
+                        os.remove(path)
+            finally:
+                self.snapshots.task_done()
+
+    def close(self, episode, global_step):
+        """
+        Save a final checkpoint, wait for all writes and close the summary writer.
+        """
+        self.save(episode, global_step)
+        self.snapshots.join()
+        self.snapshots.put(None)
+        self.thread.join()
+        self.shadow_sess.close()
+        self.summary_writer.close()
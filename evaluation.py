@@ -0,0 +1,179 @@
+from __future__ import division
+
+import math
+import random
+import multiprocessing
+import numpy as np
+
+from backgammon.game import Game
+from backgammon.cache import MoveCache
+from backgammon.bearoff import BearoffDatabase
+from backgammon.race import RaceEvaluator
+from backgammon.transposition import TABLE_SIZE, TranspositionTable
+from backgammon.profiling import PROFILER
+from backgammon.records import GameRecord, RecordWriter
+from backgammon.agents.human_agent import HumanAgent
+from backgammon.agents.random_agent import RandomAgent
+from backgammon.agents.search_agent import SearchAgent
+from backgammon.agents.td_gammon_agent import TDAgent
+from inference import NumpyModel
+
+# per-process state set up by the pool initializer
+_model = None
+_move_cache = None
+_depth = 1
+_race = None
+_table_size = TABLE_SIZE
+
+def _init_worker(weights, depth, race, bearoff_path, table_size):
+    global _model, _move_cache, _depth, _race, _table_size
+    _model = NumpyModel(weights)
+    _move_cache = MoveCache()
+    _depth = depth
+    _race = race_evaluator(race, bearoff_path)
+    _table_size = table_size
+
+def race_evaluator(race=False, bearoff_path=None):
+    """
+    RaceEvaluator for races once contact is broken, backed by the bear-off
+    database when bearoff_path is given, or None to always use the network.
+    """
+    if race or bearoff_path:
+        return RaceEvaluator.load(bearoff_path)
+    return None
+
+def td_agent(player, model, depth=1, move_cache=None, race=None, table_size=TABLE_SIZE):
+    """
+    Greedy TDAgent for 1-ply, otherwise a SearchAgent of the given depth.
+    The weights don't change while testing or playing, so the search
+    keeps a transposition table of table_size entries across turns.
+    """
+    if depth > 1:
+        return SearchAgent(player, model, depth=depth, move_cache=move_cache, table=TranspositionTable(table_size), race=race)
+    return TDAgent(player, model, race=race)
+
+def play_episode(model, seed, move_cache=None, depth=1, race=None, table_size=TABLE_SIZE):
+    """
+    Play one game of TD-Gammon against a random strategy with all randomness
+    drawn from seed. Returns (winner, gammon, plies).
+    """
+    random.seed(seed)
+    players = [td_agent(Game.TOKENS[0], model, depth, move_cache, race, table_size), RandomAgent(Game.TOKENS[1])]
+
+    game = Game.new(move_cache=move_cache)
+    player_num = random.randint(0, 1)
+    plies = 0
+    while not game.is_over():
+        game.next_step(players[player_num], player_num)
+        player_num = (player_num + 1) % 2
+        plies += 1
+
+    return game.winner(), game.is_gammon(), plies
+
+def _play_episode(seed):
+    return play_episode(_model, seed, _move_cache, _depth, _race, _table_size)
+
+def wilson_interval(wins, n, z=1.96):
+    """
+    Wilson score interval for a win rate, 95% by default.
+    """
+    if n == 0:
+        return 0., 0.
+    p = wins / n
+    denominator = 1. + z * z / n
+    center = (p + z * z / (2. * n)) / denominator
+    margin = z * math.sqrt(p * (1. - p) / n + z * z / (4. * n * n)) / denominator
+    return center - margin, center + margin
+
+def summarize(results):
+    """
+    Aggregate (winner, gammon, plies) tuples into match statistics
+    from the point of view of player 0 (TD-Gammon).
+    """
+    results = np.array(results, dtype=np.int64).reshape(-1, 3)
+    episodes = len(results)
+    wins = int(np.sum(results[:, 0] == 0))
+    gammons = results[:, 1] == 1
+    ci_low, ci_high = wilson_interval(wins, episodes)
+    return {
+        'episodes': episodes,
+        'wins': wins,
+        'win_rate': wins / episodes if episodes else 0.,
+        'win_rate_ci': (ci_low, ci_high),
+        'gammon_win_rate': np.mean(gammons & (results[:, 0] == 0)) if episodes else 0.,
+        'gammon_loss_rate': np.mean(gammons & (results[:, 0] == 1)) if episodes else 0.,
+        'mean_length': np.mean(results[:, 2]) if episodes else 0.,
+    }
+
+def evaluate(weights, episodes=1000, workers=None, seed=0, depth=1, bearoff_path=None, race=False, table_size=TABLE_SIZE):
+    """
+    Play episodes games against a random strategy spread over a pool of
+    processes. Game i always uses seed + i, so results don't depend on
+    the number of workers. With race, or a bear-off database at bearoff_path
+    for workers to memory-map, races are scored without the network.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    if bearoff_path:
+        # build the database once here rather than in every worker
+        BearoffDatabase.load(bearoff_path)
+    seeds = range(seed, seed + episodes)
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(weights, depth, race, bearoff_path, table_size))
+    try:
+        chunksize = max(1, episodes // (4 * workers))
+        results = pool.map(_play_episode, seeds, chunksize=chunksize)
+    finally:
+        pool.close()
+        pool.join()
+    return summarize(results)
+
+def print_summary(stats):
+    print("%d games: %.2f%% won (95%% CI %.2f%%-%.2f%%), gammons %.2f%% won / %.2f%% lost, %.1f plies per game" % ( \
+        stats['episodes'], stats['win_rate'] * 100.0, \
+        stats['win_rate_ci'][0] * 100.0, stats['win_rate_ci'][1] * 100.0, \
+        stats['gammon_win_rate'] * 100.0, stats['gammon_loss_rate'] * 100.0, \
+        stats['mean_length']))
+
+def test(model, episodes=100, draw=False, workers=0, seed=0, move_cache=None, depth=1, bearoff_path=None, race=False, profile_path=None, \
+        record_path=None, table_size=TABLE_SIZE):
+    """
+    Test any model with a get_output method (Model or NumpyModel)
+    against a random strategy. Games played in this process are profiled,
+    the report is printed at the end and appended to profile_path when given.
+    They are also appended to the game record file at record_path when given.
+    """
+    # spread the games over a process pool and only report the aggregate
+    if workers:
+        print_summary(evaluate(model.get_weights(), episodes, workers, seed, depth, bearoff_path, race, table_size))
+        return
+
+    players = [td_agent(Game.TOKENS[0], model, depth, move_cache, race_evaluator(race, bearoff_path), table_size), RandomAgent(Game.TOKENS[1])]
+    winners = [0, 0]
+    records = RecordWriter(record_path) if record_path else None
+    PROFILER.reset()
+    for episode in range(episodes):
+        game = Game.new(move_cache=move_cache)
+        if records is not None:
+            game.record = GameRecord()
+
+        winner = game.play(players, draw=draw)
+        winners[winner] += 1
+        if records is not None:
+            records.add(game.record.to_array(winner))
+
+        winners_total = sum(winners)
+        print("[Episode %d] %s (%s) vs %s (%s) %d:%d of %d games (%.2f%%)" % (episode, \
+            players[0].name, players[0].player, \
+            players[1].name, players[1].player, \
+            winners[0], winners[1], winners_total, \
+            (winners[0] / winners_total) * 100.0))
+
+    if records is not None:
+        records.close()
+
+    print("Profile: %s" % PROFILER.report())
+    if profile_path:
+        PROFILER.write(profile_path)
+
+def play(model, depth=1, bearoff_path=None, race=False, table_size=TABLE_SIZE):
+    game = Game.new()
+    game.play([td_agent(Game.TOKENS[0], model, depth, race=race_evaluator(race, bearoff_path), table_size=table_size), HumanAgent(Game.TOKENS[1])], draw=True)
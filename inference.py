@@ -0,0 +1,144 @@
+import os
+import re
+import numpy as np
+
+from backgammon.features import BOARD_SIZE, encoder_for_width
+
+def weight_names(layers):
+    """
+    Checkpoint names of the value network variables of a network with
+    the given number of layers, in the order get_weights returns them.
+    """
+    names = []
+    for i in range(1, layers + 1):
+        names += ['layer%d/weight' % i, 'layer%d/bias' % i]
+    return names
+
+# names for the default network of one hidden layer
+WEIGHT_NAMES = weight_names(2)
+
+# weights exported with a checkpoint, by global step
+HISTORY_NAME = 'td_gammon-%d.npz'
+_HISTORY_PATTERN = re.compile(r'^td_gammon-(\d+)\.npz$')
+
+def weight_history(path):
+    """
+    (global step, path) of the exported weights in the directory path,
+    oldest first.
+    """
+    if not os.path.isdir(path):
+        return []
+    history = []
+    for name in os.listdir(path):
+        match = _HISTORY_PATTERN.match(name)
+        if match:
+            history.append((int(match.group(1)), os.path.join(path, name)))
+    return sorted(history)
+
+def sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+class NumpyModel(object):
+    """
+    Inference-only value network evaluated with NumPy matmuls.
+
+    Has the same get_output/get_weights interface as Model, so agents,
+    evaluation and play can use either. Doesn't import TensorFlow unless
+    weights are read straight from a checkpoint. The layer sizes, the
+    number of outputs and the feature encoder all follow from the shapes
+    of the weights.
+
+    get_output_boards scores boards without building the input rows:
+    the first layer is folded into a table of its pre-activations by
+    slot and count, and each board only sums the rows of its occupied
+    slots (see FeatureEncoder.encode_sparse), a dozen or so rows where
+    the dense matmul goes through every input unit.
+    """
+
+    # most floats gathered from the first layer table at once, so the
+    # gathered rows stay in cache while they're summed
+    GATHER_SIZE = 1 << 15
+
+    def __init__(self, weights):
+        self.set_weights(weights)
+
+    def set_weights(self, weights):
+        weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.layers = list(zip(weights[0::2], weights[1::2]))
+        self.encoder = encoder_for_width(self.layers[0][0].shape[0])
+        self.outputs = self.layers[-1][0].shape[1]
+        # first layer tables by num_pieces, built on first use
+        self.tables = {}
+
+    def get_weights(self):
+        return [w for layer in self.layers for w in layer]
+
+    def get_output(self, x):
+        for W, b in self.layers:
+            x = sigmoid(np.dot(x, W) + b)
+        return x
+
+    def first_layer_table(self, num_pieces=(15, 15)):
+        """
+        (table, turns): the first layer pre-activation contributed by
+        each slot_features row and the bias plus the turn units for
+        either player to move.
+        """
+        num_pieces = tuple(num_pieces)
+        if num_pieces not in self.tables:
+            W, b = self.layers[0]
+            table = np.dot(self.encoder.slot_features(num_pieces), W)
+            empty = np.zeros((2, BOARD_SIZE), dtype=np.int8)
+            turns = np.dot(self.encoder.encode(empty, [0, 1], num_pieces), W) + b
+            self.tables[num_pieces] = (table, turns)
+        return self.tables[num_pieces]
+
+    def get_output_boards(self, boards, turn, num_pieces=(15, 15)):
+        """
+        get_output of the encoded boards with the player at index turn
+        (a scalar or an [N] array) to move.
+        """
+        table, turns = self.first_layer_table(num_pieces)
+        active = self.encoder.encode_sparse(boards)
+        x = np.empty((len(active), table.shape[1]), dtype=np.float32)
+        step = max(1, self.GATHER_SIZE // max(1, active.shape[1] * table.shape[1]))
+        for start in range(0, len(active), step):
+            table.take(active[start:start + step], axis=0).sum(axis=1, out=x[start:start + step])
+        x += turns[np.asarray(turn)]
+        x = sigmoid(x)
+        for W, b in self.layers[1:]:
+            x = sigmoid(np.dot(x, W) + b)
+        return x
+
+    def save(self, path):
+        """
+        Write the weights to path, replacing an existing file atomically
+        so processes loading it never see a partial file.
+        """
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **dict(zip(weight_names(len(self.layers)), self.get_weights())))
+        os.rename(path + '.tmp', path)
+
+    @staticmethod
+    def load(path):
+        """
+        Load weights written by NumpyModel.save or Model.export_weights.
+        """
+        data = np.load(path)
+        layers = len(data.files) // 2
+        return NumpyModel([data[name] for name in weight_names(layers)])
+
+    @staticmethod
+    def from_checkpoint(checkpoint_path):
+        """
+        Read the layer weights from the latest checkpoint in checkpoint_path.
+        """
+        import tensorflow as tf
+        latest_checkpoint_path = tf.train.latest_checkpoint(checkpoint_path)
+        if not latest_checkpoint_path:
+            raise IOError('No checkpoint found in {0}'.format(checkpoint_path))
+        reader = tf.train.NewCheckpointReader(latest_checkpoint_path)
+        layers = 0
+        while reader.has_tensor('layer%d/weight' % (layers + 1)):
+            layers += 1
+        return NumpyModel([reader.get_tensor(name) for name in weight_names(layers)])
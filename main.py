@@ -1,14 +1,48 @@
 import os
-import tensorflow as tf
+import argparse
 
-from model import Model
+import server
+import evaluation
+from inference import NumpyModel
+from backgammon.profiling import cprofile
+from backgammon.transposition import TABLE_SIZE
 
-flags = tf.app.flags
-FLAGS = flags.FLAGS
-
-flags.DEFINE_boolean('test', False, 'If true, test against a random strategy.')
-flags.DEFINE_boolean('play', False, 'If true, play against a trained TD-Gammon strategy.')
-flags.DEFINE_boolean('restore', False, 'If true, restore a checkpoint before training.')
+parser = argparse.ArgumentParser(description='Train, test or play TD-Gammon.')
+parser.add_argument('--test', action='store_true', help='If true, test against a random strategy.')
+parser.add_argument('--play', action='store_true', help='If true, play against a trained TD-Gammon strategy.')
+parser.add_argument('--restore', action='store_true', help='If true, restore a checkpoint before training.')
+parser.add_argument('--graph', action='store_true', help='If true, test, play or serve from the TensorFlow training graph and a checkpoint instead of NumPy inference from the exported weights.')
+parser.add_argument('--numpy', action='store_true', help='NumPy inference is the default for --test, --play and --serve, kept for compatibility.')
+parser.add_argument('--depth', type=int, default=1, help='Search depth in plies for --test and --play (1 is greedy).')
+parser.add_argument('--race', action='store_true', help='If true, pick moves in races (no contact left and no blot that can be hit) with a pip-count evaluator instead of the network.')
+parser.add_argument('--bearoff', default='', help='Path of a bear-off database to evaluate races with, implies --race (built on first use if missing).')
+parser.add_argument('--workers', type=int, default=0, help='Number of self-play worker processes (0 plays in the training process).')
+parser.add_argument('--games', type=int, default=1, help='Number of self-play games stepped in lockstep in the training process when --workers is 0.')
+parser.add_argument('--monitor', action='store_true', help='If true, track the loss, delta and accuracy averages on every training step instead of once per game.')
+parser.add_argument('--checkpoint_interval', type=int, default=100, help='Number of training games between checkpoints.')
+parser.add_argument('--keep_checkpoints', type=int, default=1, help='Number of checkpoints to keep, with more than one their weights are also kept in models/history/ for tournament.py.')
+parser.add_argument('--checkpoint_secs', type=int, default=600, help='Maximum number of seconds between checkpoints.')
+parser.add_argument('--summary_interval', type=int, default=1, help='Number of training games between scalar summaries.')
+parser.add_argument('--histogram_interval', type=int, default=100, help='Number of training games between weight, gradient and trace histograms.')
+parser.add_argument('--profile_interval', type=int, default=100, help='Number of training games between profile reports.')
+parser.add_argument('--record', default='', help='Path of a game record file to append the training or test games to.')
+parser.add_argument('--offline', default='', help='Comma-separated game record files to train on with mini-batches instead of self-play.')
+parser.add_argument('--epochs', type=int, default=1, help='Number of passes over the game records for --offline.')
+parser.add_argument('--batch_size', type=int, default=256, help='Mini-batch size for --offline.')
+parser.add_argument('--lamda', type=float, default=0.7, help='Lambda of the TD(lambda) targets for --offline (1 trains on the game outcomes).')
+parser.add_argument('--learning_rate', type=float, default=0.01, help='Learning rate for --offline.')
+parser.add_argument('--serve', default='', help='Serve move suggestions on this localhost port, host:port or Unix socket path.')
+parser.add_argument('--max_batch', type=int, default=1024, help='Maximum number of positions evaluated in one batch by --serve.')
+parser.add_argument('--max_wait_ms', type=float, default=2., help='Milliseconds --serve waits for more requests to batch with the first one.')
+parser.add_argument('--cprofile', action='store_true', help='If true, run under cProfile and dump the stats to profile.prof in the summary directory.')
+parser.add_argument('--eval_workers', type=int, default=0, help='Number of processes to spread test games over (0 plays them one by one).')
+parser.add_argument('--seed', type=int, default=0, help='First seed of the schedule used for parallel test games.')
+parser.add_argument('--episodes', type=int, default=1000, help='Number of games played by --test.')
+parser.add_argument('--hidden', default='50', help='Comma-separated sizes of the hidden layers.')
+parser.add_argument('--outputs', type=int, default=1, choices=[1, 5], help='Number of network outputs: 1 for P(players[1] wins), 5 to add the gammon and backgammon chances of either side.')
+parser.add_argument('--encoder', default='compact', help='Feature encoder of the network inputs: compact or full.')
+parser.add_argument('--table_size', type=int, default=TABLE_SIZE, help='Number of entries in the transposition table of each searching agent (--depth above 1).')
+parser.add_argument('--move_cache_size', type=int, default=20000, help='Number of (position, roll) move sets to memoize.')
 
 model_path = os.environ.get('MODEL_PATH', 'models/')
 summary_path = os.environ.get('SUMMARY_PATH', 'summaries/')
@@ -23,14 +57,51 @@ if not os.path.exists(checkpoint_path):
 if not os.path.exists(summary_path):
     os.makedirs(summary_path)
 
-if __name__ == '__main__':
-    graph = tf.Graph()
-    sess = tf.Session(graph=graph)
-    with sess.as_default(), graph.as_default():
-        model = Model(sess, model_path, summary_path, checkpoint_path, restore=FLAGS.restore)
-        if FLAGS.test:
-            model.test(episodes=1000)
-        elif FLAGS.play:
-            model.play()
+def load_numpy_model():
+    weights_path = model_path + 'td_gammon.npz'
+    if os.path.exists(weights_path):
+        return NumpyModel.load(weights_path)
+    return NumpyModel.from_checkpoint(checkpoint_path)
+
+def main(FLAGS):
+    inference = (FLAGS.test or FLAGS.play or FLAGS.serve) and not FLAGS.graph
+    with cprofile(summary_path + 'profile.prof' if FLAGS.cprofile else None):
+        if inference and FLAGS.test:
+            evaluation.test(load_numpy_model(), episodes=FLAGS.episodes, workers=FLAGS.eval_workers, seed=FLAGS.seed, depth=FLAGS.depth, bearoff_path=FLAGS.bearoff, race=FLAGS.race, \
+                profile_path=summary_path + 'profile.jsonl', record_path=FLAGS.record or None, table_size=FLAGS.table_size)
+        elif inference and FLAGS.serve:
+            server.serve(load_numpy_model(), FLAGS.serve, race=evaluation.race_evaluator(FLAGS.race, FLAGS.bearoff), \
+                max_batch=FLAGS.max_batch, max_wait=FLAGS.max_wait_ms / 1000.)
+        elif inference and FLAGS.play:
+            evaluation.play(load_numpy_model(), depth=FLAGS.depth, bearoff_path=FLAGS.bearoff, race=FLAGS.race, table_size=FLAGS.table_size)
         else:
-            model.train()
+            # TensorFlow is only imported to train, or with --graph, so that
+            # test, play and serve processes start quickly and stay small
+            import tensorflow as tf
+            from model import Model
+
+            graph = tf.Graph()
+            sess = tf.Session(graph=graph)
+            with sess.as_default(), graph.as_default():
+                model = Model(sess, model_path, summary_path, checkpoint_path, restore=FLAGS.restore, move_cache_size=FLAGS.move_cache_size, \
+                    hidden=[int(size) for size in FLAGS.hidden.split(',') if size], outputs=FLAGS.outputs, encoder=FLAGS.encoder)
+                if FLAGS.test:
+                    model.test(episodes=FLAGS.episodes, workers=FLAGS.eval_workers, seed=FLAGS.seed, depth=FLAGS.depth, bearoff_path=FLAGS.bearoff, race=FLAGS.race, \
+                        record_path=FLAGS.record or None, table_size=FLAGS.table_size)
+                elif FLAGS.serve:
+                    server.serve(model, FLAGS.serve, race=evaluation.race_evaluator(FLAGS.race, FLAGS.bearoff), \
+                        max_batch=FLAGS.max_batch, max_wait=FLAGS.max_wait_ms / 1000.)
+                elif FLAGS.play:
+                    model.play(depth=FLAGS.depth, bearoff_path=FLAGS.bearoff, race=FLAGS.race, table_size=FLAGS.table_size)
+                elif FLAGS.offline:
+                    model.train_offline(FLAGS.offline.split(','), epochs=FLAGS.epochs, batch_size=FLAGS.batch_size, \
+                        lamda=FLAGS.lamda, learning_rate=FLAGS.learning_rate)
+                else:
+                    model.train(workers=FLAGS.workers, eval_workers=FLAGS.eval_workers, race=FLAGS.race, bearoff_path=FLAGS.bearoff, games=FLAGS.games, monitor=FLAGS.monitor, \
+                        checkpoint_interval=FLAGS.checkpoint_interval, checkpoint_secs=FLAGS.checkpoint_secs, \
+                        summary_interval=FLAGS.summary_interval, histogram_interval=FLAGS.histogram_interval, \
+                        profile_interval=FLAGS.profile_interval, record_path=FLAGS.record or None, \
+                        keep_checkpoints=FLAGS.keep_checkpoints)
+
+if __name__ == '__main__':
+    main(parser.parse_args())
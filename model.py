@@ -6,9 +6,18 @@ import numpy as np
 import tensorflow as tf
 
 from backgammon.game import Game
-from backgammon.agents.human_agent import HumanAgent
-from backgammon.agents.random_agent import RandomAgent
+from backgammon.cache import MoveCache
 from backgammon.agents.td_gammon_agent import TDAgent
+import evaluation
+from inference import NumpyModel
+from selfplay import SelfPlayPool
+from vector_env import VectorEnv
+from checkpoints import CheckpointManager
+from offline import RecordChunks, lambda_returns
+from backgammon.profiling import PROFILER
+from backgammon.records import GameRecord, RecordWriter
+from backgammon.features import BOARD_SIZE, OUTPUTS, get_encoder
+from backgammon.transposition import TABLE_SIZE
 
 # helper to initialize a weight and bias variable
 def weight_bias(shape):
@@ -22,12 +31,99 @@ def dense_layer(x, shape, activation, name):
         W, b = weight_bias(shape)
         return activation(tf.matmul(x, W) + b, name='activation')
 
+# helper to create the same layer for boards given by the slot_features rows of
+# their occupied slots (see FeatureEncoder.encode_sparse) and the player to move,
+# summing a dozen or so rows of a table of pre-activations by slot and count
+def sparse_layer(active, turn, slot_features, W, b, activation):
+    # the table is built from the few units each slot_features row sets
+    rows, cols = np.nonzero(slot_features)
+    units = tf.gather(W, cols.astype(np.int32)) * tf.constant(slot_features[rows, cols][:, None])
+    table = tf.segment_sum(units, rows.astype(np.int32))
+    # the last two inputs are the player to move
+    turns = tf.slice(W, [slot_features.shape[1] - 2, 0], [2, -1])
+    return activation(tf.reduce_sum(tf.gather(table, active), 1) + tf.gather(turns, turn) + b)
+
+# helper to score boards with the layers of the value network
+def board_network(active, turn, slot_features, layers):
+    W, b = layers[0]
+    prev_y = sparse_layer(active, turn, slot_features, W, b, tf.sigmoid)
+    for W, b in layers[1:]:
+        prev_y = tf.sigmoid(tf.matmul(prev_y, W) + b)
+    return prev_y
+
+class FusedTDStep(object):
+    """
+    Stands in for Model as the network of the TDAgents trained in this
+    process. The TD update of each ply is deferred and applied by the
+    same session call that scores the next move's candidates with the
+    updated weights, so a ply takes a single call.
+    """
+
+    def __init__(self, model, monitor=False):
+        self.model = model
+        self.monitor = monitor
+        self.pending = None
+        self.encoder = model.encoder
+        self.outputs = model.outputs
+
+    def update(self, x, V_next):
+        """
+        Queue the TD update moving V(x) towards V_next.
+        """
+        self.flush()
+        self.pending = { self.model.x: x, self.model.V_next: V_next }
+
+    def flush(self):
+        """
+        Apply the queued update on its own.
+        """
+        if self.pending is not None:
+            start = time.time()
+            train_op = self.model.train_op if self.monitor else self.model.train_step_op
+            self.model.sess.run(train_op, feed_dict=self.pending)
+            self.pending = None
+            PROFILER.add_time('td_update', start)
+
+    def get_output(self, x):
+        self.flush()
+        return self.model.get_output(x)
+
+    def get_output_boards(self, boards, turn, num_pieces=(15, 15)):
+        if self.pending is None or tuple(num_pieces) != Model.BOARD_PIECES:
+            self.flush()
+            return self.model.get_output_boards(boards, turn, num_pieces)
+
+        feed_dict = self.pending
+        feed_dict.update(self.model.board_feed(boards, turn))
+        self.pending = None
+
+        fetches = [self.model.V_candidates]
+        if self.monitor:
+            fetches.append(self.model.monitor_op)
+        return self.model.sess.run(fetches, feed_dict=feed_dict)[0]
+
 class Model(object):
-    def __init__(self, sess, model_path, summary_path, checkpoint_path, restore=False):
+
+    # checkers per player of the games scored through the sparse first layer
+    BOARD_PIECES = (15, 15)
+
+    def __init__(self, sess, model_path, summary_path, checkpoint_path, restore=False, move_cache_size=20000, \
+            hidden=(50, ), outputs=1, encoder='compact'):
         self.model_path = model_path
         self.summary_path = summary_path
         self.checkpoint_path = checkpoint_path
 
+        # inputs come from the named feature encoder, the network predicts
+        # P(players[1] wins) alone or with the gammon and backgammon chances
+        # of either side, see OUTPUTS
+        self.encoder = get_encoder(encoder)
+        if outputs not in (1, len(OUTPUTS)):
+            raise ValueError('A network has 1 or {0} outputs, got {1}'.format(len(OUTPUTS), outputs))
+        self.outputs = outputs
+
+        # legal moves are memoized by position and roll across all games
+        self.move_cache = MoveCache(move_cache_size)
+
         # setup our session
         self.sess = sess
         self.global_step = tf.Variable(0, trainable=False, name='global_step')
@@ -44,17 +140,24 @@ class Model(object):
         tf.scalar_summary('alpha', alpha)
 
         # describe network size
-        layer_size_input = 294
-        layer_size_hidden = 50
-        layer_size_output = 1
+        layer_sizes = [self.encoder.width] + list(hidden) + [outputs]
 
         # placeholders for input and target output
-        self.x = tf.placeholder('float', [1, layer_size_input], name='x')
-        self.V_next = tf.placeholder('float', [1, layer_size_output], name='V_next')
-
-        # build network arch. (just 2 layers with sigmoid activation)
-        prev_y = dense_layer(self.x, [layer_size_input, layer_size_hidden], tf.sigmoid, name='layer1')
-        self.V = dense_layer(prev_y, [layer_size_hidden, layer_size_output], tf.sigmoid, name='layer2')
+        # the batch dimension is left open so many afterstates can be scored at once
+        self.x = tf.placeholder('float', [None, layer_sizes[0]], name='x')
+        self.V_next = tf.placeholder('float', [None, outputs], name='V_next')
+
+        # boards to score instead: the active slot_features rows of each
+        # (see FeatureEncoder.encode_sparse) and the index of the player to move
+        self.active = tf.placeholder('int32', [None, None], name='active')
+        self.turn = tf.placeholder('int32', [None], name='turn')
+        slot_features = self.encoder.slot_features(Model.BOARD_PIECES)
+
+        # build network arch. (fully-connected layers with sigmoid activation)
+        prev_y = self.x
+        for i in range(len(layer_sizes) - 1):
+            prev_y = dense_layer(prev_y, layer_sizes[i:i + 2], tf.sigmoid, name='layer%d' % (i + 1))
+        self.V = prev_y
 
         # watch the individual value predictions over time
         tf.scalar_summary('V_next', tf.reduce_sum(self.V_next))
@@ -109,36 +212,48 @@ class Model(object):
         # increment global step: we keep this as a variable so it's saved with checkpoints
         global_step_op = self.global_step.assign_add(1)
 
-        # get gradients of output V wrt trainable variables (weights and biases)
+        # get gradients of each output of V wrt trainable variables (weights and biases)
         tvars = tf.trainable_variables()
-        grads = tf.gradients(self.V, tvars)
+        output_grads = [tf.gradients(tf.slice(self.V, [0, k], [-1, 1]), tvars) for k in range(outputs)]
+        output_deltas = [tf.reduce_sum(tf.slice(self.V_next - self.V, [0, k], [-1, 1])) for k in range(outputs)]
+
+        # layer weights and biases, in the order get_weights returns them
+        self.weights = tvars
+
+        # the same network scoring boards, the training updates keep feeding
+        # the input rows in x so their gradients need no sparse ops
+        self.V_boards = board_network(self.active, self.turn, slot_features, list(zip(tvars[0::2], tvars[1::2])))
 
         # watch the weight and gradient distributions
-        for grad, var in zip(grads, tvars):
-            tf.histogram_summary(var.name, var)
-            tf.histogram_summary(var.name + '/gradients/grad', grad)
+        for grad, var in zip(output_grads[0], tvars):
+            tf.histogram_summary(var.name, var, collections=['histograms'])
+            tf.histogram_summary(var.name + '/gradients/grad', grad, collections=['histograms'])
 
         # for each variable, define operations to update the var with delta,
-        # taking into account the gradient as part of the eligibility trace
+        # taking into account the gradient as part of the eligibility trace,
+        # every output keeps its own traces and delta
         apply_gradients = []
         with tf.variable_scope('apply_gradients'):
-            for grad, var in zip(grads, tvars):
-                with tf.variable_scope('trace'):
-                    # e-> = lambda * e-> + <grad of output w.r.t weights>
-                    trace = tf.Variable(tf.zeros(grad.get_shape()), trainable=False, name='trace')
-                    trace_op = trace.assign((lamda * trace) + grad)
-                    tf.histogram_summary(var.name + '/traces', trace)
-
-                # grad with trace = alpha * delta * e
-                grad_trace = alpha * delta_op * trace_op
-                tf.histogram_summary(var.name + '/gradients/trace', grad_trace)
+            for i, var in enumerate(tvars):
+                grad_trace = 0.
+                for k in range(outputs):
+                    grad = output_grads[k][i]
+                    suffix = '' if k == 0 else '_' + OUTPUTS[k]
+                    with tf.variable_scope('trace'):
+                        # e-> = lambda * e-> + <grad of output w.r.t weights>
+                        trace = tf.Variable(tf.zeros(grad.get_shape()), trainable=False, name='trace' + suffix)
+                        trace_op = trace.assign((lamda * trace) + grad)
+                        tf.histogram_summary(var.name + '/traces' + suffix, trace, collections=['histograms'])
+
+                    # grad with trace = alpha * delta * e
+                    grad_trace += alpha * output_deltas[k] * trace_op
+                tf.histogram_summary(var.name + '/gradients/trace', grad_trace, collections=['histograms'])
 
                 grad_apply = var.assign_add(grad_trace)
                 apply_gradients.append(grad_apply)
 
         # as part of training we want to update our step and other monitoring variables
-        with tf.control_dependencies([
-            global_step_op,
+        monitor_ops = [
             game_step_op,
             loss_sum_op,
             delta_sum_op,
@@ -146,12 +261,36 @@ class Model(object):
             loss_avg_ema_op,
             delta_avg_ema_op,
             accuracy_avg_ema_op
-        ]):
+        ]
+        self.monitor_op = tf.group(*monitor_ops, name='monitor')
+        with tf.control_dependencies([global_step_op] + monitor_ops):
             # define single operation to apply all gradient updates
             self.train_op = tf.group(*apply_gradients, name='train')
 
+        # the same update without the per-step monitoring variables
+        with tf.control_dependencies([global_step_op]):
+            self.train_step_op = tf.group(*apply_gradients, name='train_step')
+
+        # mini-batch gradient descent on the squared error to the targets in V_next,
+        # for offline training from recorded games, every batch counts as a step
+        self.learning_rate = tf.placeholder('float', [], name='learning_rate')
+        self.loss_op = loss_op
+        self.batch_train_op = tf.train.GradientDescentOptimizer(self.learning_rate).minimize(loss_op, \
+            global_step=self.global_step, var_list=self.weights, name='batch_train')
+
+        # fused TD step: apply the update for (x, V_next) and score the next move's
+        # candidate afterstates, fed as boards, with the updated weights in a single
+        # session call, the assign ops return the updated variables so they're read
+        # after the update
+        with tf.control_dependencies([global_step_op]):
+            updated = [tf.identity(var) for var in apply_gradients]
+        prev_y = board_network(self.active, self.turn, slot_features, list(zip(updated[0::2], updated[1::2])))
+        self.V_candidates = tf.identity(prev_y, name='V_candidates')
+
         # merge summaries for TensorBoard
+        # histograms are kept apart from the scalars so they can be written less often
         self.summaries_op = tf.merge_all_summaries()
+        self.histograms_op = tf.merge_all_summaries(key='histograms')
 
         # create a saver for periodic checkpoints
         self.saver = tf.train.Saver(max_to_keep=1)
@@ -172,70 +311,226 @@ class Model(object):
     def get_output(self, x):
         return self.sess.run(self.V, feed_dict={ self.x: x })
 
-    def play(self):
-        game = Game.new()
-        game.play([TDAgent(Game.TOKENS[0], self), HumanAgent(Game.TOKENS[1])], draw=True)
-
-    def test(self, episodes=100, draw=False):
-        players = [TDAgent(Game.TOKENS[0], self), RandomAgent(Game.TOKENS[1])]
-        winners = [0, 0]
-        for episode in range(episodes):
-            game = Game.new()
-
-            winner = game.play(players, draw=draw)
-            winners[winner] += 1
-
-            winners_total = sum(winners)
-            print("[Episode %d] %s (%s) vs %s (%s) %d:%d of %d games (%.2f%%)" % (episode, \
-                players[0].name, players[0].player, \
-                players[1].name, players[1].player, \
-                winners[0], winners[1], winners_total, \
-                (winners[0] / winners_total) * 100.0))
-
-    def train(self):
+    def board_feed(self, boards, turn):
+        boards = np.asarray(boards).reshape(-1, BOARD_SIZE)
+        return { self.active: self.encoder.encode_sparse(boards).astype(np.int32), \
+            self.turn: np.broadcast_to(turn, (len(boards), )).astype(np.int32) }
+
+    def get_output_boards(self, boards, turn, num_pieces=(15, 15)):
+        """
+        get_output of the encoded boards with the player at index turn
+        (a scalar or an [N] array) to move, through the sparse first layer
+        for games of BOARD_PIECES checkers.
+        """
+        if tuple(num_pieces) != Model.BOARD_PIECES:
+            return self.get_output(self.encoder.encode(boards, turn, num_pieces))
+        return self.sess.run(self.V_boards, feed_dict=self.board_feed(boards, turn))
+
+    def get_weights(self):
+        return self.sess.run(self.weights)
+
+    def export_weights(self, path):
+        """
+        Write the network weights for inference.NumpyModel.
+        """
+        NumpyModel(self.get_weights()).save(path)
+
+    def play(self, depth=1, bearoff_path=None, race=False, table_size=TABLE_SIZE):
+        evaluation.play(self, depth=depth, bearoff_path=bearoff_path, race=race, table_size=table_size)
+
+    def test(self, episodes=100, draw=False, workers=0, seed=0, depth=1, bearoff_path=None, race=False, record_path=None, \
+            table_size=TABLE_SIZE):
+        evaluation.test(self, episodes, draw=draw, workers=workers, seed=seed, move_cache=self.move_cache, \
+            depth=depth, bearoff_path=bearoff_path, race=race, profile_path=self.summary_path + 'profile.jsonl', \
+            record_path=record_path, table_size=table_size)
+
+    def train(self, workers=0, sync_interval=10, eval_workers=0, race=False, bearoff_path=None, games=1, monitor=False, \
+            checkpoint_interval=100, checkpoint_secs=600, summary_interval=1, histogram_interval=100, profile_interval=100, \
+            record_path=None, keep_checkpoints=1):
         tf.train.write_graph(self.sess.graph_def, self.model_path, 'td_gammon.pb', as_text=False)
         summary_writer = tf.train.SummaryWriter('{0}{1}'.format(self.summary_path, int(time.time()), self.sess.graph_def))
 
-        # the agent plays against itself, making the best move for each player
-        players = [TDAgent(Game.TOKENS[0], self), TDAgent(Game.TOKENS[1], self)]
+        # checkpoints and summaries are written at intervals, checkpoints from a background thread
+        checkpoints = CheckpointManager(self.sess, summary_writer, self.checkpoint_path, \
+            checkpoint_interval=checkpoint_interval, checkpoint_secs=checkpoint_secs, \
+            summary_interval=summary_interval, histogram_interval=histogram_interval, \
+            summaries_op=self.summaries_op, histograms_op=self.histograms_op, \
+            export_path=self.model_path + 'td_gammon.npz', weights=self.weights, \
+            keep_checkpoints=keep_checkpoints, history_path=self.model_path + 'history/' if keep_checkpoints > 1 else None)
+
+        # the agent plays against itself, making the best move for each player,
+        # moves in races are picked by the race evaluator rather than the network
+        race_evaluator = evaluation.race_evaluator(race, bearoff_path)
+        td_step = FusedTDStep(self, monitor)
+        players = [TDAgent(Game.TOKENS[0], td_step, race=race_evaluator), TDAgent(Game.TOKENS[1], td_step, race=race_evaluator)]
+
+        # per-step loss, delta and accuracy averages are only tracked when monitoring,
+        # otherwise the game summaries cover the final step
+        train_op = self.train_op if monitor else self.train_step_op
 
         validation_interval = 1000
         episodes = 5000
 
+        # the training games are appended to a game record file in bulk
+        records = RecordWriter(record_path) if record_path else None
+
+        # with workers, self-play runs in separate processes against weight snapshots
+        # and this process only applies the TD updates from their trajectories,
+        # with several games they are played here in lockstep sharing every forward pass
+        trajectories = None
+        if workers:
+            trajectories = SelfPlayPool(workers, self.get_weights(), race=race, bearoff_path=bearoff_path, record=records is not None)
+            trajectories.start()
+        elif games > 1:
+            trajectories = VectorEnv(self, games, self.move_cache, race_evaluator, record=records is not None)
+
+        PROFILER.reset()
         for episode in range(episodes):
             if episode != 0 and episode % validation_interval == 0:
-                self.test(episodes=100)
+                self.test(episodes=100, workers=eval_workers, bearoff_path=bearoff_path, race=race)
+                # keep the validation games out of the training profile
+                PROFILER.reset()
+
+            if trajectories is not None:
+                if workers and episode != 0 and episode % sync_interval == 0:
+                    trajectories.sync(self.get_weights())
+
+                # the self-play workers are profiled in their own processes
+                start = time.time()
+                features, next_values, winner, plies = trajectories.get()
+                if workers:
+                    PROFILER.add_time('wait', start)
+
+                start = time.time()
+                game_step = len(features) - 1
+                for t in range(game_step):
+                    self.sess.run(train_op, feed_dict={ self.x: features[t:t + 1], self.V_next: next_values[t:t + 1] })
+                x = features[-1:]
+                outcome = next_values[-1:]
+                PROFILER.add_time('td_update', start)
+            else:
+                game = Game.new(move_cache=self.move_cache)
+                if records is not None:
+                    game.record = GameRecord()
+                player_num = random.randint(0, 1)
+
+                x = game.extract_features(players[player_num].player, self.encoder)
+
+                game_step = 0
+                while not game.is_over():
+                    agent = players[player_num]
+                    agent.value = None
+                    game.next_step(agent, player_num)
+                    player_num = (player_num + 1) % 2
+
+                    # the agent already scored the afterstate picking its move, with a single
+                    # output it only needs a forward pass when there was no move to pick, or
+                    # when the race evaluator scored it, as the targets are the network's values
+                    x_next = game.extract_features(players[player_num].player, self.encoder)
+                    V_next = agent.value if self.outputs == 1 else None
+                    if V_next is not None and race_evaluator is not None and race_evaluator.covers(game.encode())[0]:
+                        V_next = None
+                    if V_next is None:
+                        turn = game.players.index(players[player_num].player)
+                        V_next = td_step.get_output_boards(game.encode(), turn, game.piece_counts())[0]
+                    td_step.update(x, np.array(V_next, dtype='float').reshape(1, -1))
+
+                    x = x_next
+                    game_step += 1
+
+                td_step.flush()
+                winner = game.winner()
+                outcome = game.outcome(self.outputs).reshape(1, -1)
+                plies = game.record.to_array(winner) if records is not None else None
+
+            if records is not None:
+                records.add(plies)
+
+            start = time.time()
+            results = self.sess.run([
+                self.train_op,
+                self.global_step,
+                self.reset_op
+            ] + checkpoints.summary_fetches(episode), feed_dict={ self.x: x, self.V_next: outcome })
+            global_step = results[1]
+            checkpoints.add_summaries(results[3:], global_step)
+            PROFILER.add_time('td_update', start)
+            PROFILER.count('games')
+            PROFILER.count('plies', game_step)
 
-            game = Game.new()
-            player_num = random.randint(0, 1)
+            print("Game %d/%d (Winner: %s) in %d turns" % (episode, episodes, players[winner].player, game_step))
 
-            x = game.extract_features(players[player_num].player)
+            start = time.time()
+            checkpoints.maybe_save(episode + 1, global_step)
+            PROFILER.add_time('checkpoint', start)
 
-            game_step = 0
-            while not game.is_over():
-                game.next_step(players[player_num], player_num)
-                player_num = (player_num + 1) % 2
+            if (episode + 1) % profile_interval == 0:
+                print("Profile: %s" % PROFILER.report())
+                PROFILER.write_summaries(summary_writer, global_step)
+                PROFILER.write(self.summary_path + 'profile.jsonl')
+                PROFILER.reset()
 
-                x_next = game.extract_features(players[player_num].player)
-                V_next = self.get_output(x_next)
-                self.sess.run(self.train_op, feed_dict={ self.x: x, self.V_next: V_next })
+        checkpoints.close(episodes, global_step)
+        if records is not None:
+            records.close()
 
-                x = x_next
-                game_step += 1
+        self.export_weights(self.model_path + 'td_gammon.npz')
 
-            winner = game.winner()
+        if workers:
+            trajectories.close()
 
-            _, global_step, summaries, _ = self.sess.run([
-                self.train_op,
-                self.global_step,
-                self.summaries_op,
-                self.reset_op
-            ], feed_dict={ self.x: x, self.V_next: np.array([[winner]], dtype='float') })
-            summary_writer.add_summary(summaries, global_step=global_step)
+        print("Move cache: %d entries, %.2f%% hit rate" % (len(self.move_cache), self.move_cache.hit_rate() * 100.0))
 
-            print("Game %d/%d (Winner: %s) in %d turns" % (episode, episodes, players[winner].player, game_step))
-            self.saver.save(self.sess, self.checkpoint_path + 'checkpoint', global_step=global_step)
+        self.test(episodes=1000, workers=eval_workers)
 
+    def train_offline(self, record_paths, epochs=1, batch_size=256, lamda=0.7, learning_rate=0.01, \
+            chunk_plies=1 << 14, prefetch=4, profile_interval=10):
+        """
+        Train on recorded games instead of self-play. Each chunk of games
+        read from the record files is scored in one forward pass, its
+        TD(lambda) targets are computed for whole games at once and the
+        network is then trained on them in shuffled mini-batches.
+        lamda 1 trains on the game outcomes alone.
+        """
+        summary_writer = tf.train.SummaryWriter('{0}{1}'.format(self.summary_path, int(time.time()), self.sess.graph_def))
+        chunks = RecordChunks(record_paths, epochs=epochs, chunk_plies=chunk_plies, prefetch=prefetch, \
+            encoder=self.encoder, outputs=self.outputs)
+        print("Training on %d plies of %d games for %d epochs" % (chunks.num_plies(), chunks.num_games(), epochs))
+
+        PROFILER.reset()
+        start = time.time()
+        for n, (features, bounds, outcomes) in enumerate(chunks):
+            PROFILER.add_time('wait', start)
+
+            start = time.time()
+            values = self.get_output(features)
+            targets = lambda_returns(values, bounds, outcomes, lamda).astype(np.float32)
+            PROFILER.add_time('targets', start)
+
+            start = time.time()
+            order = np.random.permutation(len(features))
+            losses = []
+            for k in range(0, len(order), batch_size):
+                batch = order[k:k + batch_size]
+                _, loss = self.sess.run([self.batch_train_op, self.loss_op], feed_dict={ \
+                    self.x: features[batch], self.V_next: targets[batch], self.learning_rate: learning_rate })
+                losses.append(loss)
+            PROFILER.add_time('batch_update', start)
+            PROFILER.count('games', len(bounds) - 1)
+            PROFILER.count('plies', len(features))
+
+            global_step = self.sess.run(self.global_step)
+            summary = tf.Summary(value=[tf.Summary.Value(tag='offline/loss', simple_value=float(np.mean(losses)))])
+            summary_writer.add_summary(summary, global_step=global_step)
+            print("Chunk %d: %d games, loss %.5f" % (n, len(bounds) - 1, np.mean(losses)))
+
+            if (n + 1) % profile_interval == 0:
+                print("Profile: %s" % PROFILER.report())
+                PROFILER.write_summaries(summary_writer, global_step)
+                PROFILER.write(self.summary_path + 'profile.jsonl')
+                PROFILER.reset()
+            start = time.time()
+
+        self.saver.save(self.sess, self.checkpoint_path + 'checkpoint', global_step=self.global_step)
         summary_writer.close()
-
-        self.test(episodes=1000)
+        self.export_weights(self.model_path + 'td_gammon.npz')
@@ -0,0 +1,113 @@
+from __future__ import division
+
+import random
+import Queue
+import threading
+import numpy as np
+
+from backgammon.features import COMPACT, game_outcomes
+from backgammon.records import RecordReader
+
+def lambda_returns(values, bounds, outcomes, lamda):
+    """
+    TD(lambda) targets for the plies of consecutive games.
+
+    values holds the network outputs for every recorded position, bounds
+    the first ply of each game and the end of the last one, outcomes the
+    targets of the outputs for each game (the winner for a single
+    output). Every game must be finished, as RecordReader's are, since
+    its last ply gets the outcome. The target of ply t is
+
+        G_t = (1 - lamda) * V_{t+1} + lamda * G_{t+1}
+
+    with the outcome as the return of the last ply, which is computed for
+    all games and outputs at once by stepping back from their longest
+    ply. lamda 0 is the one-step TD target of online training and lamda 1
+    the outcome of the game, i.e. supervised training on the results.
+    Returns an [N, outputs] array.
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+    lengths = np.diff(bounds)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    cols = np.arange(len(values)) - np.repeat(bounds[:-1], lengths)
+
+    # the value of the next position counts towards each ply but the last,
+    # which gets the outcome instead
+    rewards = np.zeros((len(lengths), lengths.max() if len(lengths) else 0, values.shape[1]))
+    rewards[rows[:-1], cols[:-1]] = (1. - lamda) * values[1:]
+    rewards[np.arange(len(lengths)), lengths - 1] = np.asarray(outcomes).reshape(len(lengths), -1)
+
+    returns = np.zeros((rewards.shape[0], rewards.shape[1] + 1, rewards.shape[2]))
+    for t in range(rewards.shape[1] - 1, -1, -1):
+        returns[:, t] = rewards[:, t] + lamda * returns[:, t + 1]
+    return returns[rows, cols]
+
+class RecordChunks(object):
+    """
+    Streams game record files as chunks of whole games, each the
+    (features, bounds, outcomes) of about chunk_plies plies, featurized
+    with encoder and with the targets of the first outputs network
+    outputs for each game. Only finished games are read, a game left
+    partly written by an interrupted writer is skipped (see RecordReader).
+
+    Chunks are read from the memory-mapped files and featurized on a
+    background thread, up to prefetch of them ahead of the consumer.
+    With shuffle, the chunks are visited in a new random order every
+    epoch.
+    """
+
+    def __init__(self, paths, epochs=1, chunk_plies=1 << 14, prefetch=4, shuffle=True, seed=None, encoder=COMPACT, outputs=1):
+        self.readers = [RecordReader(path) for path in paths]
+        self.epochs = epochs
+        self.encoder = encoder
+        self.outputs = outputs
+        self.shuffle = shuffle
+        self.random = random.Random(seed)
+
+        # (reader, first game, end game) of every chunk
+        self.chunks = []
+        for reader in self.readers:
+            first = 0
+            while first < len(reader):
+                end = np.searchsorted(reader.bounds, reader.bounds[first] + chunk_plies, side='right') - 1
+                end = min(max(end, first + 1), len(reader))
+                self.chunks.append((reader, first, end))
+                first = end
+
+        self.queue = Queue.Queue(maxsize=prefetch)
+        self.thread = threading.Thread(target=self._read)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def num_plies(self):
+        return sum(reader.num_plies() for reader in self.readers)
+
+    def num_games(self):
+        return sum(len(reader) for reader in self.readers)
+
+    def _read(self):
+        try:
+            for _ in range(self.epochs):
+                chunks = list(self.chunks)
+                if self.shuffle:
+                    self.random.shuffle(chunks)
+                for reader, first, end in chunks:
+                    bounds = reader.bounds[first:end + 1]
+                    plies = reader.plies[bounds[0]:bounds[-1]]
+                    features = self.encoder.encode(plies['board'], plies['turn'])
+                    bounds = bounds - bounds[0]
+                    # the loser's checkers are as in the position before the winner's last move
+                    last = plies[bounds[1:] - 1]
+                    self.queue.put((features, bounds, game_outcomes(last['board'], last['winner'], self.outputs)))
+            self.queue.put(None)
+        except Exception as e:
+            self.queue.put(e)
+
+    def __iter__(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
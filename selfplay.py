@@ -0,0 +1,106 @@
+from __future__ import division
+
+import Queue
+import random
+import multiprocessing
+import numpy as np
+
+from backgammon.game import Game
+from backgammon.cache import MoveCache
+from backgammon.records import GameRecord
+from backgammon.agents.td_gammon_agent import TDAgent
+from evaluation import race_evaluator
+from inference import NumpyModel
+
+def play_game(model, move_cache=None, race=None, record=False):
+    """
+    Play one self-play game and return its trajectory: the features of
+    every state, the TD target for each of them (the value of the next
+    state, or the outcome for the terminal state), the winner and, with
+    record, the game's plies for a RecordWriter (None otherwise). Moves
+    in races are picked by race when given.
+    """
+    game = Game.new(move_cache=move_cache, compact=True)
+    if record:
+        game.record = GameRecord()
+    players = [TDAgent(Game.TOKENS[0], model, race=race), TDAgent(Game.TOKENS[1], model, race=race)]
+    player_num = random.randint(0, 1)
+
+    features = [game.extract_features(players[player_num].player, model.encoder)]
+    while not game.is_over():
+        game.next_step(players[player_num], player_num)
+        player_num = (player_num + 1) % 2
+        features.append(game.extract_features(players[player_num].player, model.encoder))
+
+    winner = game.winner()
+
+    features = np.vstack(features)
+    next_values = np.empty((len(features), model.outputs), dtype=np.float32)
+    next_values[:-1] = model.get_output(features[1:])
+    next_values[-1] = game.outcome(model.outputs)
+
+    plies = game.record.to_array(winner) if record else None
+    return features, next_values, winner, plies
+
+def _worker(seed, weights_queue, trajectories, race=False, bearoff_path=None, record=False):
+    random.seed(seed)
+    np.random.seed(seed)
+
+    model = NumpyModel(weights_queue.get())
+    move_cache = MoveCache()
+    race = race_evaluator(race, bearoff_path)
+
+    while True:
+        # pick up the latest weights whenever the learner has published some
+        try:
+            model.set_weights(weights_queue.get_nowait())
+        except Queue.Empty:
+            pass
+        trajectories.put(play_game(model, move_cache, race, record))
+
+class SelfPlayPool(object):
+    """
+    Worker processes playing self-play games against snapshots of the
+    network weights, evaluated with NumPy, and streaming the trajectories back to the learner.
+    With record, the trajectories carry the plies of each game for the learner to write.
+    """
+
+    def __init__(self, workers, weights, seed=None, race=False, bearoff_path=None, record=False):
+        if seed is None:
+            seed = random.randint(0, 2 ** 31 - 1)
+        self.trajectories = multiprocessing.Queue(maxsize=workers * 4)
+        self.weights_queues = [multiprocessing.Queue(maxsize=1) for _ in range(workers)]
+        self.processes = []
+        for i, weights_queue in enumerate(self.weights_queues):
+            process = multiprocessing.Process(target=_worker, args=(seed + i, weights_queue, self.trajectories, race, bearoff_path, record))
+            process.daemon = True
+            self.processes.append(process)
+        self.sync(weights)
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def sync(self, weights):
+        """
+        Publish a new snapshot of the weights, replacing any snapshot
+        a worker hasn't picked up yet.
+        """
+        for weights_queue in self.weights_queues:
+            try:
+                weights_queue.get_nowait()
+            except Queue.Empty:
+                pass
+            # never block the learner, a pending snapshot is recent enough
+            try:
+                weights_queue.put_nowait(weights)
+            except Queue.Full:
+                pass
+
+    def get(self):
+        return self.trajectories.get()
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
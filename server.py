@@ -0,0 +1,269 @@
+"""
+Local move-suggestion server.
+
+Clients send one JSON request per line and get one JSON reply per line,
+over a localhost TCP port or a Unix socket:
+
+    {"board": [28 signed counts], "turn": 0, "dice": [3, 1], "top": 3}
+
+board is in the layout of Game.encode (positive counts for players[0]),
+turn the index of the player to move. The reply lists the best moves
+for that player by cubeless equity, best first, with the chances that
+player wins and, for a network with gammon outputs, that it wins or
+loses a gammon or a backgammon:
+
+    {"moves": [{"move": [[16, 19], [18, 19]], "equity": 0.12, "win": 0.55,
+                "win_gammon": 0.14, "win_backgammon": 0.01,
+                "lose_gammon": 0.12, "lose_backgammon": 0.01}, ...]}
+
+Each connection is served by its own thread, while all network
+evaluations go through a single MicroBatcher that coalesces concurrent
+requests into one forward pass.
+"""
+from __future__ import division
+
+import os
+import json
+import stat
+import time
+import socket
+import Queue
+import threading
+import SocketServer
+import numpy as np
+
+from backgammon.game import Game
+from backgammon.features import BOARD_SIZE, NUM_POINTS, OUTPUTS, cubeless_equity
+from backgammon.movegen import generate_moves
+from backgammon.profiling import PROFILER
+from backgammon.transposition import evaluate_outputs
+
+class _Request(object):
+
+    def __init__(self, x, turn=None):
+        self.x = x
+        self.turn = turn
+        self.done = threading.Event()
+        self.result = None
+
+class MicroBatcher(object):
+    """
+    Stands in for a model shared by many threads. get_output calls are
+    queued and a single thread evaluates everything that arrives within
+    max_wait seconds of the first request, up to max_batch rows, in one
+    forward pass of the model. A model with get_output_boards gets
+    boards rather than features, so its sparse first layer is kept.
+
+    Callers spend their time in get_output waiting for the batch, which
+    is profiled as 'wait', the forward passes themselves as 'inference'.
+    """
+
+    profile_phase = 'wait'
+
+    def __init__(self, model, max_batch=1024, max_wait=0.002):
+        self.model = model
+        self.encoder = model.encoder
+        self.outputs = model.outputs
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = Queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        if hasattr(model, 'get_output_boards'):
+            self.get_output_boards = self._get_output_boards
+
+    def get_output(self, x):
+        return self._wait(_Request(x))
+
+    def _get_output_boards(self, boards, turn, num_pieces=(15, 15)):
+        if tuple(num_pieces) != (15, 15):
+            raise ValueError('only positions with 15 checkers each are batched')
+        return self._wait(_Request(boards, np.broadcast_to(turn, (len(boards), ))))
+
+    def _wait(self, request):
+        self.requests.put(request)
+        request.done.wait()
+        if isinstance(request.result, Exception):
+            raise request.result
+        return request.result
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        rows = len(batch[0].x)
+        deadline = time.time() + self.max_wait
+        while rows < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except Queue.Empty:
+                break
+            batch.append(request)
+            rows += len(request.x)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start = time.time()
+            # feature rows and boards go through separate forward passes
+            for requests in ([r for r in batch if r.turn is None], [r for r in batch if r.turn is not None]):
+                if requests:
+                    self._evaluate(requests)
+            PROFILER.add_time('inference', start)
+            PROFILER.count('batches')
+            for request in batch:
+                request.done.set()
+
+    def _evaluate(self, requests):
+        try:
+            x = np.concatenate([request.x for request in requests])
+            if requests[0].turn is None:
+                outputs = self.model.get_output(x)
+            else:
+                outputs = self.model.get_output_boards(x, np.concatenate([request.turn for request in requests]))
+            bounds = np.cumsum([0] + [len(request.x) for request in requests])
+            for k, request in enumerate(requests):
+                request.result = outputs[bounds[k]:bounds[k + 1]]
+        except Exception as e:
+            for request in requests:
+                request.result = e
+
+class MoveSuggester(object):
+    """
+    Scores every distinct afterstate of a position and roll with all
+    outputs of the model. With a RaceEvaluator, the winning chances of
+    races are its estimate instead.
+    """
+
+    def __init__(self, model, race=None):
+        self.model = model
+        self.race = race
+
+    def suggest(self, request):
+        # counts are checked before narrowing them to the int8 board
+        board = np.asarray(request['board'], dtype=np.int64)
+        turn = int(request['turn'])
+        dice = tuple(int(d) for d in request['dice'])
+        top = int(request.get('top', 5))
+        if board.shape != (BOARD_SIZE, ):
+            raise ValueError('board must have {0} counts'.format(BOARD_SIZE))
+        if turn not in (0, 1):
+            raise ValueError('turn must be 0 or 1')
+        if len(dice) != 2 or not all(1 <= d <= 6 for d in dice):
+            raise ValueError('dice must be two values from 1 to 6')
+        if np.any(np.abs(board) > 15) or np.any(board[NUM_POINTS:] < 0):
+            raise ValueError('points hold at most 15 checkers, bar and off counts are 0 to 15')
+        points = board[:NUM_POINTS]
+        checkers = (np.maximum(points, 0).sum() + board[NUM_POINTS] + board[NUM_POINTS + 2], \
+            np.maximum(-points, 0).sum() + board[NUM_POINTS + 1] + board[NUM_POINTS + 3])
+        if checkers != (15, 15):
+            raise ValueError('each player must have 15 checkers, got {0} and {1}'.format(*checkers))
+        board = board.astype(np.int8)
+        if np.any(board[NUM_POINTS + 2:] >= 15):
+            raise ValueError('the game is over')
+
+        moves, afterstates = generate_moves(board, turn, dice, unique=True, on=Game.ON, off=Game.OFF)
+        if not moves:
+            return { 'moves': [] }
+
+        # the afterstates are scored with the opponent to move
+        afterstates = np.array(afterstates, dtype=np.int8)
+        outputs = evaluate_outputs(self.model, afterstates, 1 - turn, (15, 15))
+        if self.race is not None:
+            covered = self.race.covers(afterstates)
+            if np.any(covered):
+                outputs[covered, 0] = self.race.get_output(afterstates[covered], 1 - turn)
+
+        # outputs are from the side of players[1], swap them for players[0]
+        equity = cubeless_equity(outputs)
+        if turn == 0:
+            equity = -equity
+            outputs[:, 0] = 1. - outputs[:, 0]
+            if outputs.shape[1] > 1:
+                outputs[:, 1:] = outputs[:, [3, 4, 1, 2]]
+        order = np.argsort(-equity)[:top]
+        PROFILER.count('requests')
+        replies = []
+        for i in order:
+            reply = dict(zip(OUTPUTS, [float(v) for v in outputs[i]]))
+            reply['move'] = [list(die_move) for die_move in moves[i]]
+            reply['equity'] = float(equity[i])
+            replies.append(reply)
+        return { 'moves': replies }
+
+class MoveHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                reply = self.server.suggester.suggest(json.loads(line))
+            except Exception as e:
+                # any failure is reported rather than dropping the connection
+                reply = { 'error': str(e) or type(e).__name__ }
+            self.wfile.write(json.dumps(reply) + '\n')
+            self.wfile.flush()
+
+class TCPMoveServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class UnixMoveServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+def parse_address(address):
+    """
+    (host, port) for 'host:port' or a port number, else a Unix socket path.
+    """
+    address = str(address)
+    if address.isdigit():
+        return ('127.0.0.1', int(address))
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return (host or '127.0.0.1', int(port))
+    return address
+
+def make_server(model, address='127.0.0.1:8765', race=None, max_batch=1024, max_wait=0.002):
+    address = parse_address(address)
+    server_class = TCPMoveServer if isinstance(address, tuple) else UnixMoveServer
+    # a socket left behind by a previous server, never any other file
+    if server_class is UnixMoveServer and os.path.exists(address):
+        if not stat.S_ISSOCK(os.stat(address).st_mode):
+            raise ValueError('{0} exists and is not a socket'.format(address))
+        os.remove(address)
+    server = server_class(address, MoveHandler)
+    server.suggester = MoveSuggester(MicroBatcher(model, max_batch, max_wait), race)
+    return server
+
+def serve(model, address='127.0.0.1:8765', race=None, max_batch=1024, max_wait=0.002):
+    """
+    Serve move suggestions until interrupted.
+    """
+    server = make_server(model, address, race, max_batch, max_wait)
+    print('Serving move suggestions on {0}'.format(address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def suggest(address, board, turn, dice, top=5):
+    """
+    Ask the server at address for the best moves, for clients and testing.
+    """
+    address = parse_address(address)
+    family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+        f = sock.makefile('rw')
+        f.write(json.dumps({ 'board': list(board), 'turn': turn, 'dice': list(dice), 'top': top }) + '\n')
+        f.flush()
+        return json.loads(f.readline())
+    finally:
+        sock.close()
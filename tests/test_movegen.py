@@ -0,0 +1,31 @@
+"""
+The move generator against the recursive reference generators, on a
+seeded corpus of positions and all 21 rolls, as benchmark.py --check:
+
+    python -m unittest discover tests
+"""
+import unittest
+
+from backgammon.compact_game import CompactGame
+from benchmark import CATEGORIES, build_corpus, check_moves
+
+class MoveGeneratorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.corpus = build_corpus(size=20, seed=1)
+
+    def test_matches_collect_moves(self):
+        self.assertEqual(check_moves(self.corpus), [])
+
+    def test_matches_compact_find_moves(self):
+        corpus = dict((name, [(CompactGame.from_game(game), player, roll) for game, player, roll in positions]) \
+            for name, positions in self.corpus.items())
+        self.assertEqual(check_moves(corpus), [])
+
+    def test_corpus_covers_every_category(self):
+        for name in CATEGORIES:
+            self.assertEqual(len(self.corpus[name]), 20, name)
+
+if __name__ == '__main__':
+    unittest.main()
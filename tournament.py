@@ -0,0 +1,208 @@
+"""
+Round-robin and gauntlet tournaments between network snapshots and
+agent types, played over a pool of processes:
+
+    python tournament.py models/history/ random models/td_gammon.npz@2 --games 200
+
+A player is `random`, a weights file (a greedy TDAgent), a weights file
+with @depth for a SearchAgent of that depth, or a directory of weights
+exported with --keep_checkpoints, which adds every snapshot in it. Every
+game is appended to the results file as soon as it finishes and games
+already in it are skipped, so an interrupted tournament resumes where it
+stopped. At the end, the standings are printed with Elo ratings fitted
+to all games in the results file.
+"""
+from __future__ import division
+
+import os
+import sys
+import json
+import math
+import random
+import argparse
+import itertools
+import multiprocessing
+
+from backgammon.game import Game
+from backgammon.cache import MoveCache
+from backgammon.bearoff import BearoffDatabase
+from backgammon.transposition import TABLE_SIZE
+from backgammon.agents.random_agent import RandomAgent
+from evaluation import td_agent, race_evaluator
+from inference import NumpyModel, weight_history
+
+# per-process state set up by the pool initializer
+_models = {}
+_move_cache = None
+_race = None
+_table_size = TABLE_SIZE
+
+def _init_worker(race, bearoff_path, table_size):
+    global _move_cache, _race, _table_size
+    _move_cache = MoveCache()
+    _race = race_evaluator(race, bearoff_path)
+    _table_size = table_size
+
+def expand_players(specs):
+    """
+    Player names for the command line specs, with directories
+    replaced by the snapshots in them, oldest first. Paths are
+    normalized and every player is listed once, so no player is
+    scheduled against itself.
+    """
+    players, seen = [], set()
+    for spec in specs:
+        path, _, depth = spec.partition('@')
+        suffix = '@' + depth if depth else ''
+        paths = [p for _, p in weight_history(path)] if os.path.isdir(path) else [path]
+        for path in paths:
+            key = os.path.abspath(path) + suffix
+            if key not in seen:
+                seen.add(key)
+                players.append(os.path.normpath(path) + suffix)
+    return players
+
+def make_agent(player, token):
+    if player == 'random':
+        return RandomAgent(token)
+    path, _, depth = player.partition('@')
+    if path not in _models:
+        _models[path] = NumpyModel.load(path)
+    return td_agent(token, _models[path], int(depth or 1), _move_cache, _race, _table_size)
+
+def play_match_game(task):
+    """
+    Play game seed of player a against player b. a plays players[0] in
+    even games and players[1] in odd ones. Returns the task with the
+    winner and whether it was a gammon.
+    """
+    a, b, seed = task
+    random.seed(seed)
+    if seed % 2 == 0:
+        tokens = {a: Game.TOKENS[0], b: Game.TOKENS[1]}
+    else:
+        tokens = {a: Game.TOKENS[1], b: Game.TOKENS[0]}
+    agents = [make_agent(a, tokens[a]), make_agent(b, tokens[b])]
+    agents.sort(key=lambda agent: Game.TOKENS.index(agent.player))
+
+    game = Game.new(move_cache=_move_cache)
+    winner = game.play(agents)
+    return { 'a': a, 'b': b, 'seed': seed, 'winner': a if tokens[a] == Game.TOKENS[winner] else b, 'gammon': game.is_gammon() }
+
+def schedule(players, games, seed=0, gauntlet=False):
+    """
+    (a, b, seed) for every game: games between each pair of players, or
+    with gauntlet only between the first player and each of the others.
+    Every pairing plays the same seeds.
+    """
+    if gauntlet:
+        pairs = [(players[0], other) for other in players[1:]]
+    else:
+        pairs = list(itertools.combinations(players, 2))
+    return [(a, b, s) for a, b in pairs for s in range(seed, seed + games)]
+
+def load_results(path):
+    results = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    results.append(json.loads(line))
+    return results
+
+def run(tasks, results_path, workers=None, race=False, bearoff_path=None, table_size=TABLE_SIZE):
+    """
+    Play the tasks not in the results file yet over a process pool,
+    appending each game to the file as it finishes.
+    """
+    done = set((r['a'], r['b'], r['seed']) for r in load_results(results_path))
+    tasks = [task for task in tasks if task not in done]
+    print("%d games to play, %d already played" % (len(tasks), len(done)))
+    if not tasks:
+        return
+
+    workers = workers or multiprocessing.cpu_count()
+    if bearoff_path:
+        # build the database once here rather than in every worker
+        BearoffDatabase.load(bearoff_path)
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(race, bearoff_path, table_size))
+    try:
+        chunksize = max(1, len(tasks) // (16 * workers))
+        with open(results_path, 'a') as f:
+            for n, result in enumerate(pool.imap_unordered(play_match_game, tasks, chunksize=chunksize)):
+                f.write(json.dumps(result, sort_keys=True) + '\n')
+                f.flush()
+                if (n + 1) % 100 == 0:
+                    print("%d/%d games" % (n + 1, len(tasks)))
+    finally:
+        pool.close()
+        pool.join()
+
+def elo_ratings(results, iterations=200):
+    """
+    Elo ratings of the Bradley-Terry model fitted to the results by
+    minorization-maximization, with the average player at 0. Every pair
+    that met gets half a virtual win each way, so unbeaten players still
+    get finite ratings.
+    """
+    players = sorted(set(r['a'] for r in results) | set(r['b'] for r in results))
+    wins = dict(((a, b), 0.) for a in players for b in players)
+    for r in results:
+        loser = r['b'] if r['winner'] == r['a'] else r['a']
+        wins[r['winner'], loser] += 1
+    for a, b in itertools.permutations(players, 2):
+        if wins[a, b] or wins[b, a]:
+            wins[a, b] += 0.5
+
+    strength = dict((p, 1.) for p in players)
+    for _ in range(iterations):
+        for p in players:
+            total = sum(wins[p, q] for q in players if q != p)
+            games = sum((wins[p, q] + wins[q, p]) / (strength[p] + strength[q]) for q in players if q != p)
+            if games > 0:
+                strength[p] = total / games
+        mean = sum(math.log(s) for s in strength.values()) / len(players)
+        strength = dict((p, math.exp(math.log(s) - mean)) for p, s in strength.items())
+    return dict((p, 400. * math.log10(s)) for p, s in strength.items())
+
+def standings(results):
+    """
+    Rows of (player, Elo, games, win rate, gammon win rate), best first.
+    """
+    ratings = elo_ratings(results)
+    rows = []
+    for p in ratings:
+        games = [r for r in results if p in (r['a'], r['b'])]
+        won = [r for r in games if r['winner'] == p]
+        gammons = [r for r in won if r['gammon']]
+        rows.append((p, ratings[p], len(games), len(won) / len(games), len(gammons) / len(games)))
+    return sorted(rows, key=lambda row: -row[1])
+
+def print_standings(results):
+    rows = standings(results)
+    width = max([len(row[0]) for row in rows] + [6])
+    print("%-*s %7s %6s %7s %7s" % (width, 'player', 'elo', 'games', 'won', 'gammons'))
+    for player, elo, games, win_rate, gammon_rate in rows:
+        print("%-*s %7.1f %6d %6.2f%% %6.2f%%" % (width, player, elo, games, win_rate * 100.0, gammon_rate * 100.0))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('players', nargs='+', help='random, a weights file, weights@depth or a directory of snapshots.')
+    parser.add_argument('--games', type=int, default=100, help='Games between each pair of players.')
+    parser.add_argument('--gauntlet', action='store_true', help='Only play the first player against each of the others.')
+    parser.add_argument('--workers', type=int, default=0, help='Number of processes (0 uses every CPU).')
+    parser.add_argument('--seed', type=int, default=0, help='First seed of the games of each pairing.')
+    parser.add_argument('--results', default='tournament.jsonl', help='File the games are appended to and resumed from.')
+    parser.add_argument('--race', action='store_true', help='Pick moves in races with a pip-count evaluator.')
+    parser.add_argument('--table_size', type=int, default=TABLE_SIZE, help='Number of entries in the transposition table of each searching player.')
+    parser.add_argument('--bearoff', default='', help='Path of a bear-off database to evaluate races with.')
+    args = parser.parse_args()
+
+    players = expand_players(args.players)
+    if len(players) < 2:
+        sys.exit('A tournament needs at least two players, got %s' % players)
+    run(schedule(players, args.games, args.seed, args.gauntlet), args.results, args.workers, args.race, args.bearoff or None, args.table_size)
+    print_standings(load_results(args.results))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+from __future__ import division
+
+import time
+import random
+import collections
+import numpy as np
+
+from backgammon.game import Game
+from backgammon.features import BOARD_SIZE, equity_value
+from backgammon.records import GameRecord
+from backgammon.profiling import PROFILER
+from backgammon.transposition import evaluate_outputs
+
+class VectorEnv(object):
+    """
+    Self-play games stepped in lockstep. Every step rolls the dice in all
+    games, scores the afterstates of all of them with a single forward
+    pass, plays the best move in each game and starts a new game in place
+    of every finished one. Only the afterstates played are featurized, as
+    the states of the trajectories.
+
+    Finished games are queued as the same (features, next_values, winner, plies)
+    trajectories selfplay.play_game returns, so the learner consumes them
+    exactly like SelfPlayPool's. The TD target of each state is the
+    network's value of the afterstate its move was picked from, no
+    position is scored twice. With a RaceEvaluator, moves in races are
+    picked by it, but the targets are still the network's values for all
+    outputs, as in selfplay.play_game and Model.train.
+    """
+
+    def __init__(self, model, games=16, move_cache=None, race=None, record=False):
+        self.model = model
+        self.move_cache = move_cache
+        self.race = race
+        self.record = record
+        self.games = [None] * games
+        self.player_nums = [0] * games
+        self.features = [None] * games
+        self.next_values = [None] * games
+        self.finished = collections.deque()
+        for k in range(games):
+            self.reset(k)
+
+    def __len__(self):
+        return len(self.games)
+
+    def reset(self, k):
+        """
+        Start a new game in slot k.
+        """
+        game = Game.new(move_cache=self.move_cache, compact=True)
+        if self.record:
+            game.record = GameRecord()
+        self.games[k] = game
+        self.player_nums[k] = random.randint(0, 1)
+        self.features[k] = [game.extract_features(Game.TOKENS[self.player_nums[k]], self.model.encoder)]
+        self.next_values[k] = []
+
+    def step(self):
+        """
+        Play one ply in every game. Returns the number of games that
+        finished, their trajectories are queued for get.
+        """
+        start = time.time()
+        moves, boards, turns, rolls = [], [], [], []
+        for k, game in enumerate(self.games):
+            player = Game.TOKENS[self.player_nums[k]]
+            roll = game.roll_dice()
+            rolls.append(roll)
+            actions, afterstates = self.get_afterstates(game, roll, player)
+            # with no legal moves the position is passed on unchanged
+            if not actions:
+                actions = [None]
+                afterstates = np.array(game.encode(), dtype=np.int8).reshape(1, BOARD_SIZE)
+            moves.append(actions)
+            boards.append(afterstates)
+            turns.append(np.repeat(game.players.index(game.opponent(player)), len(actions)))
+
+        PROFILER.add_time('move_generation', start)
+        PROFILER.count('turns', len(self.games))
+        PROFILER.count('moves', sum(len(m) for m in moves))
+
+        boards = np.vstack(boards)
+        turns = np.concatenate(turns)
+        values, scores = self.evaluate(boards, turns)
+
+        # slice of the afterstates of each game and the one played
+        bounds = np.cumsum([0] + [len(m) for m in moves])
+        picks = []
+        for k, game in enumerate(self.games):
+            player = Game.TOKENS[self.player_nums[k]]
+            v = scores[bounds[k]:bounds[k + 1]]
+            picks.append(bounds[k] + int(np.argmax(1. - v if player == game.players[0] else v)))
+
+        start = time.time()
+        features = self.model.encoder.encode(boards[picks], turns[picks], self.games[0].piece_counts())
+        PROFILER.add_time('featurize', start)
+
+        finished = 0
+        for k, game in enumerate(self.games):
+            player = Game.TOKENS[self.player_nums[k]]
+            i = picks[k] - bounds[k]
+            if game.record is not None:
+                game.record.add(game.encode(), game.players.index(player), rolls[k], moves[k][i], scores[picks[k]] if moves[k][i] else None)
+            if moves[k][i]:
+                game.take_action(moves[k][i], player)
+            self.player_nums[k] = 1 - self.player_nums[k]
+
+            # the chosen afterstate is the next state, with the opponent to move
+            self.features[k].append(features[k])
+            self.next_values[k].append(values[picks[k]])
+
+            if game.is_over():
+                winner = game.winner()
+                self.next_values[k].append(game.outcome(values.shape[1]))
+                next_values = np.array(self.next_values[k], dtype=np.float32)
+                plies = game.record.to_array(winner) if game.record is not None else None
+                self.finished.append((np.vstack(self.features[k]), next_values, winner, plies))
+                self.reset(k)
+                finished += 1
+        return finished
+
+    def get(self):
+        """
+        Trajectory of the next finished game, stepping all games until one is done.
+        """
+        while not self.finished:
+            self.step()
+        return self.finished.popleft()
+
+    def get_afterstates(self, game, roll, player):
+        if self.move_cache is not None:
+            return self.move_cache.get_afterstates(game, roll, player)
+        return game.get_afterstates(roll, player)
+
+    def evaluate(self, boards, turns):
+        """
+        (values, scores) for the afterstates, with the player at the index
+        in turns to move: the network outputs, P(players[1] wins) first,
+        from one forward pass over all of them, and the equity_value the
+        moves are picked by, the race evaluator's winning chances in races.
+        """
+        values = evaluate_outputs(self.model, boards, turns, self.games[0].piece_counts())
+        scores = equity_value(values)
+        if self.race is not None:
+            races = self.race.covers(boards)
+            for turn in range(2):
+                rows = races & (turns == turn)
+                if np.any(rows):
+                    scores[rows] = self.race.get_output(boards[rows], turn)
+        return values, scores